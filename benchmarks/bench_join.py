@@ -0,0 +1,179 @@
+"""
+End-to-end join-latency benchmark against the local stub Jitsi server.
+
+Drives the real join path (jitsi.launch and jitsi.run) in headless Chromium with a fake
+camera, N times, and reports each phase's latency with percentiles:
+
+    launch     starting Chromium and opening a blank page (0 with --warm)
+    navigate   page.goto until the page shows prejoin, auth, or the conference
+    fill_name  typing the display name on the prejoin screen
+    join       clicking join until the next screen (auth or the conference)
+    auth       filling in and submitting the login dialog until the conference
+    joined     total, from launch to in conference
+
+Phases the path didn't go through (e.g. prejoin with FAST_JOIN, auth without --auth)
+are left out. Needs Playwright and its Chromium installed.
+
+Usage, from the repo root:
+    python -m benchmarks.bench_join --runs 20
+    python -m benchmarks.bench_join --runs 20 --auth --no-fast-join --output join.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utilities  # noqa: E402
+import jitsi  # noqa: E402
+from benchmarks.stub_jitsi import StubJitsiServer  # noqa: E402
+from playwright.sync_api import sync_playwright  # noqa: E402
+
+PHASES = ('launch', 'navigate', 'fill_name', 'join', 'auth', 'joined')
+
+# Fake camera and microphone, so getUserMedia works without hardware
+FAKE_MEDIA_ARGS = ['--use-fake-device-for-media-stream']
+
+
+class PhaseTimer:
+    """Turn jitsi.run() state changes and step calls into per-phase durations."""
+
+    def __init__(self, leave: threading.Event):
+        self.leave = leave
+        self.durations = {}
+        self.failed = None
+        self.last = None
+        self._phase = None
+
+    def start(self, phase: str) -> None:
+        """ End the running phase, and start timing `phase`. """
+        now = time.perf_counter()
+        if self._phase is not None:
+            self.durations[self._phase] = now - self.last
+        self._phase, self.last = phase, now
+
+    def on_state(self, state: str, detail: str = '') -> None:
+        if state == 'navigating':
+            self.start('navigate')
+        elif state == 'prejoin':
+            self.start('fill_name')
+        elif state == 'auth':
+            self.start('auth')
+        elif state == 'joined':
+            self.start(None)
+            self.leave.set()
+        elif state == 'failed':
+            self.failed = detail
+            self.leave.set()
+
+    def wrap(self, func, phase: str):
+        """ Start `phase` when a jitsi step function is called. """
+        def wrapped(*args, **kwargs):
+            self.start(phase)
+            return func(*args, **kwargs)
+        return wrapped
+
+
+def write_settings(url: str, fast_join: bool) -> None:
+    """ Point Settings/jitsi.env in the current directory at the stub server. """
+    with utilities.Settings.transaction(jitsi.SETTINGS_FILE) as tx:
+        for key, value in {
+            'JITSI_URL': url,
+            'MEETING_ID': 'benchmark',
+            'DISPLAY_NAME': 'Benchmark Bot',
+            'USER_NAME': 'bot',
+            'USER_PASSWORD': 'secret',
+            'FAST_JOIN': 'Yes' if fast_join else 'No',
+            'ADAPTIVE_QUALITY': 'No',
+        }.items():
+            tx.set(key, value)
+
+
+def run_once(playwright, browser=None) -> dict:
+    """ Time one join. With a running `browser`, only a fresh context is opened (warm start). """
+    leave = threading.Event()
+    timer = PhaseTimer(leave)
+    # fill_name starts on the 'prejoin' state, the click is timed by wrapping the step jitsi.run() calls
+    click_join = jitsi.click_join
+    jitsi.click_join = timer.wrap(click_join, 'join')
+    started = time.perf_counter()
+    if browser is None:
+        own_browser, context, page = jitsi.launch(playwright, extra_args=FAKE_MEDIA_ARGS)
+    else:
+        own_browser, context = None, browser.new_context()
+        page = context.new_page()
+    launched = time.perf_counter()
+    try:
+        jitsi.run(page, leave, timer.on_state)
+    finally:
+        jitsi.click_join = click_join
+        context.close()
+        if own_browser is not None:
+            own_browser.close()
+    if timer.failed is not None:
+        raise RuntimeError(timer.failed)
+    timer.durations['launch'] = launched - started if browser is None else 0.0
+    timer.durations['joined'] = timer.last - started
+    return timer.durations
+
+
+def percentiles(values: list) -> dict:
+    """ p50/p90/p95/max of a list of seconds, in milliseconds. """
+    values = sorted(v * 1000 for v in values)
+    def pick(q):
+        return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+    return {'runs': len(values), 'p50_ms': statistics.median(values), 'p90_ms': pick(0.9),
+            'p95_ms': pick(0.95), 'max_ms': values[-1]}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the Jitsi join path against a local stub server.')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--auth', action='store_true', help='Stub server requires login.')
+    parser.add_argument('--no-fast-join', action='store_true', help='Go through the prejoin screen.')
+    parser.add_argument('--warm', action='store_true', help='Reuse one browser, like BROWSER_WARM.')
+    parser.add_argument('--output', help='Write results as JSON to this file.')
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    server = StubJitsiServer(auth=args.auth).start()
+    runs = []
+    with tempfile.TemporaryDirectory(prefix='streambot-join-') as scratch:
+        os.chdir(scratch)
+        try:
+            write_settings(server.url, fast_join=not args.no_fast_join)
+            with sync_playwright() as playwright:
+                browser = None
+                if args.warm:
+                    browser, context, _page = jitsi.launch(playwright, extra_args=FAKE_MEDIA_ARGS)
+                    context.close()
+                for i in range(args.runs):
+                    runs.append(run_once(playwright, browser))
+                    print(f"run {i + 1}/{args.runs}: joined in {runs[-1]['joined'] * 1000:.0f} ms")
+                if browser is not None:
+                    browser.close()
+        finally:
+            os.chdir(cwd)
+            server.stop()
+
+    results = {}
+    print(f"{'phase':10} {'runs':>5} {'p50 ms':>8} {'p90 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for phase in PHASES:
+        values = [run[phase] for run in runs if phase in run]
+        if not values:
+            continue
+        results[phase] = percentiles(values)
+        r = results[phase]
+        print(f"{phase:10} {r['runs']:5} {r['p50_ms']:8.0f} {r['p90_ms']:8.0f} {r['p95_ms']:8.0f} {r['max_ms']:8.0f}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'options': vars(args), 'results': results, 'runs': runs}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""
+Cost of one metrics sample.
+
+Times MetricsCollector.sample() (the /proc walk, /sys reads and rendering) with some child
+processes running, like Chromium's would be, and reports it as a share of the sampling
+interval, which is what the collector adds to the Pi's load.
+
+It runs in a scratch directory, so the collector's logging doesn't write Settings.ini or Logs/
+into the checkout. Usage, from the repo root:
+    python -m benchmarks.bench_metrics --children 12 --repeat 200
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import metrics  # noqa: E402
+import utilities  # noqa: E402
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Benchmark one metrics sample.')
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--children', type=int, default=12, help='Child processes to start, standing in for Chromium.')
+    parser.add_argument('--interval', type=float, default=10.0, help='Sampling interval to report the load against.')
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='streambot-bench-') as scratch:
+        os.chdir(scratch)
+        children = [subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(3600)'])
+                    for _ in range(args.children)]
+        try:
+            collector = metrics.MetricsCollector(port=0)
+            collector.sample()
+            wall, cpu = [], []
+            for _ in range(args.repeat):
+                started, cpu_started = time.perf_counter(), time.thread_time()
+                collector.sample()
+                wall.append((time.perf_counter() - started) * 1000)
+                cpu.append((time.thread_time() - cpu_started) * 1000)
+            # Counted while the children are still running
+            in_proc = sum(1 for name in os.listdir('/proc') if name.isdigit())
+            in_tree = sum(r['processes'] for r in collector.tree.sample().values())
+        finally:
+            for child in children:
+                child.kill()
+                child.wait()
+            utilities.Logs.stop()
+            os.chdir(cwd)
+
+    wall.sort()
+    print(f"processes in /proc: {in_proc}, in the bot's tree: {in_tree}")
+    print(f"sample wall ms: p50 {statistics.median(wall):.2f}, p95 {wall[int(len(wall) * 0.95) - 1]:.2f}, "
+          f"max {wall[-1]:.2f}")
+    print(f"sample CPU ms:  mean {statistics.mean(cpu):.2f}, "
+          f"{statistics.mean(cpu) / 1000 / args.interval * 100:.3f}% of one core at {args.interval:g}s intervals")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,230 @@
+"""
+Micro-benchmarks for the utilities module.
+
+Measures latency and I/O per call for the Ini, Settings, Files and Logs helpers, on small
+(realistic) and large settings files, cold and warm. "Cold" means the Settings snapshot
+cache is empty (or, for Logs, the logging pipeline isn't set up yet); the OS page cache
+can't be dropped without root, so it is warm in both cases.
+
+I/O is read from /proc/self/io: read/write syscalls and bytes, per call. It covers the
+whole process, so the log listener thread's writes are counted too.
+
+Usage, from the repo root:
+    python -m benchmarks.bench_utilities --output results.json
+    python -m benchmarks.bench_utilities --compare baseline.json --threshold 0.25
+
+With --compare, exits with status 1 if any benchmark's median got slower than the
+baseline by more than the threshold (a fraction, 0.25 = 25%).
+"""
+import os
+import io
+import sys
+import json
+import time
+import logging
+import logging.handlers
+import argparse
+import platform
+import tempfile
+import contextlib
+import statistics
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utilities  # noqa: E402
+
+# Key counts for a realistic env file (like jitsi.env) and a large one
+SIZES = {'small': 15, 'large': 2000}
+
+
+def read_io() -> dict:
+    """ Process-wide I/O counters, empty if /proc/self/io isn't available. """
+    try:
+        with open('/proc/self/io', 'r', encoding='utf-8') as f:
+            return {key: int(value) for key, value in (line.split(': ') for line in f)}
+    except (OSError, IOError, ValueError):
+        return {}
+
+
+def io_overhead(samples: int = 50) -> dict:
+    """ I/O counted by reading /proc/self/io itself, subtracted from every measurement. """
+    totals = {'syscr': 0, 'syscw': 0, 'rchar': 0, 'wchar': 0}
+    for _ in range(samples):
+        before = read_io()
+        after = read_io()
+        for key in totals:
+            totals[key] += after.get(key, 0) - before.get(key, 0)
+    return {key: value / samples for key, value in totals.items()}
+
+
+def measure(func, repeat: int, setup=None) -> dict:
+    """
+    Time `func` over `repeat` calls, running `setup` (untimed) before each.
+
+    Returns:
+        dict: Latency percentiles in microseconds and mean I/O per call.
+    """
+    timings = []
+    io_totals = {'syscr': 0, 'syscw': 0, 'rchar': 0, 'wchar': 0}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            before = read_io()
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            after = read_io()
+            timings.append(elapsed * 1e6)
+            for key in io_totals:
+                io_totals[key] += after.get(key, 0) - before.get(key, 0)
+    timings.sort()
+    overhead = io_overhead()
+    return {
+        'calls': repeat,
+        'min_us': timings[0],
+        'median_us': statistics.median(timings),
+        'p95_us': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        'read_syscalls': max(io_totals['syscr'] / repeat - overhead['syscr'], 0.0),
+        'write_syscalls': max(io_totals['syscw'] / repeat - overhead['syscw'], 0.0),
+        'read_bytes': max(io_totals['rchar'] / repeat - overhead['rchar'], 0.0),
+        'write_bytes': max(io_totals['wchar'] / repeat - overhead['wchar'], 0.0),
+    }
+
+
+def make_settings(path: str, keys: int) -> None:
+    """ Write a settings file with `keys` keys in DEFAULT and a LOGGING section. """
+    with utilities.Settings.transaction(path) as tx:
+        for i in range(keys):
+            tx.set(f'KEY_{i}', f'value-{i}')
+        tx.set('LOGGING_LEVEL', 'INFO', section='LOGGING')
+
+
+def reset_logs() -> None:
+    """ Tear down the logging pipeline so the next Logs() sets it up again. """
+    utilities.Logs.stop()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            root.removeHandler(handler)
+
+
+def run_all(repeat: int) -> dict:
+    """ Run every benchmark in a scratch directory and return results by name. """
+    results = {}
+    for size, keys in SIZES.items():
+        path = os.path.join('Settings', f'{size}.env')
+        make_settings(path, keys)
+        last_key = f'KEY_{keys - 1}'
+        some_keys = [f'KEY_{i}' for i in range(0, keys, max(keys // 5, 1))][:5]
+        invalidate = utilities.Settings.invalidate
+
+        results[f'ini_load/{size}/cold'] = measure(
+            lambda: utilities.Ini.load(path, 'DEFAULT', last_key), repeat, setup=invalidate)
+        results[f'ini_load/{size}/warm'] = measure(
+            lambda: utilities.Ini.load(path, 'DEFAULT', last_key), repeat)
+        results[f'get_many/{size}/cold'] = measure(
+            lambda: utilities.Settings.get_many(path, some_keys), repeat, setup=invalidate)
+        results[f'get_many/{size}/warm'] = measure(
+            lambda: utilities.Settings.get_many(path, some_keys), repeat)
+        results[f'get_sections/{size}/cold'] = measure(
+            lambda: utilities.Ini.get_sections(path), repeat, setup=invalidate)
+        results[f'get_sections/{size}/warm'] = measure(
+            lambda: utilities.Ini.get_sections(path), repeat)
+        results[f'ini_write/{size}'] = measure(
+            lambda: utilities.Ini.write(path, 'DEFAULT', 'KEY_0', 'changed'), max(repeat // 10, 5))
+
+        def transaction(path=path):
+            with utilities.Settings.transaction(path) as tx:
+                for i in range(5):
+                    tx.set(f'KEY_{i}', 'changed')
+        results[f'transaction_5_keys/{size}'] = measure(transaction, max(repeat // 10, 5))
+
+    existing = os.path.join('Settings', 'small.env')
+    missing = os.path.join('Settings', 'missing.env')
+    created = os.path.join('Settings', 'created', 'new.env')
+    results['check_exist/existing'] = measure(lambda: utilities.Files.check_exist(existing), repeat)
+    results['check_exist/missing'] = measure(lambda: utilities.Files.check_exist(missing), repeat)
+    results['create'] = measure(lambda: utilities.Files.create(created), max(repeat // 10, 5),
+                                setup=lambda: utilities.Files.remove(created))
+
+    results['logs_init/cold'] = measure(lambda: utilities.Logs('Bench'), max(repeat // 20, 5), setup=reset_logs)
+    results['logs_init/warm'] = measure(lambda: utilities.Logs('Bench'), repeat)
+    logs = utilities.Logs('Bench')
+    with contextlib.redirect_stdout(io.StringIO()):
+        logs.set_level('INFO')
+    results['log_info/enabled'] = measure(lambda: logs.info("Set %s = %s", 'KEY', 'value'), repeat)
+    results['log_debug/disabled'] = measure(lambda: logs.debug("Set %s = %s", 'KEY', 'value'), repeat)
+    return results
+
+
+def git_revision() -> str:
+    """ Current commit of the repo, or '' outside a git checkout. """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Find benchmarks whose median latency regressed past the threshold.
+
+    Returns:
+        list: (name, baseline median, new median) for each regression.
+    """
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old and result['median_us'] > old['median_us'] * (1 + threshold):
+            regressions.append((name, old['median_us'], result['median_us']))
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--repeat', type=int, default=200, help='Calls per benchmark (default 200).')
+    parser.add_argument('--output', help='Write results as JSON to this file.')
+    parser.add_argument('--compare', help='Baseline JSON file to compare against.')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Allowed median slowdown vs the baseline, as a fraction (default 0.25).')
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='streambot-bench-') as scratch:
+        os.chdir(scratch)
+        try:
+            results = run_all(args.repeat)
+        finally:
+            reset_logs()
+            os.chdir(cwd)
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+    print(f"{'benchmark':32} {'median us':>10} {'p95 us':>10} {'reads':>6} {'writes':>6} {'wbytes':>8}")
+    for name, r in results.items():
+        print(f"{name:32} {r['median_us']:10.1f} {r['p95_us']:10.1f} {r['read_syscalls']:6.1f} "
+              f"{r['write_syscalls']:6.1f} {r['write_bytes']:8.0f}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for name, old, new in regressions:
+            print(f"REGRESSION {name}: {old:.1f}us -> {new:.1f}us ({new / old - 1:+.0%})")
+        if regressions:
+            return 1
+        print(f"No regressions over {args.threshold:.0%}.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""
+A local stand-in for a Jitsi server, for benchmarking the join path offline.
+
+Serves a fake meeting page with the parts of Jitsi that jitsi.run() drives: the prejoin
+screen ("Enter your name" / "Join meeting"), an optional "Authentication required" dialog,
+and window.APP.conference.isJoined() once the fake conference is up. The page honours the
+config.prejoinConfig.enabled fragment used by FAST_JOIN, asks for the camera like Jitsi
+does, and loads a cacheable script standing in for the Jitsi bundle.
+
+Usage, from the repo root:
+    python -m benchmarks.stub_jitsi --port 8000 --auth
+"""
+import sys
+import json
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<title>Stub Jitsi</title>
+<script src="/libs/app.bundle.min.js"></script>
+</head>
+<body>
+<div id="prejoin" hidden>
+    <input type="text" aria-label="Enter your name" placeholder="Enter your name">
+    <div role="button" aria-label="Join meeting" tabindex="0" id="join">Join meeting</div>
+</div>
+<div id="auth" hidden>
+    <h2>Authentication required</h2>
+    <input type="text" placeholder="User identifier" id="user">
+    <input type="password" placeholder="Password" id="password">
+    <button id="login">Login</button>
+</div>
+<div id="conference" hidden>Conference joined</div>
+<script>
+const OPTIONS = __OPTIONS__;
+let joined = false;
+window.APP = {conference: {isJoined: () => joined}};
+
+const hash = new URLSearchParams(location.hash.slice(1));
+const prejoinEnabled = hash.get('config.prejoinConfig.enabled') !== 'false'
+    && hash.get('config.prejoinPageEnabled') !== 'false';
+
+function show(id) {
+    for (const el of document.querySelectorAll('body > div')) el.hidden = el.id !== id;
+}
+
+function conference() {
+    setTimeout(async () => {
+        try { await navigator.mediaDevices.getUserMedia({video: true}); } catch (e) { /* no camera */ }
+        joined = true;
+        show('conference');
+    }, OPTIONS.joinDelayMs);
+}
+
+function join() {
+    if (OPTIONS.auth) show('auth'); else conference();
+}
+
+document.getElementById('join').addEventListener('click', join);
+document.getElementById('login').addEventListener('click', () => {
+    const ok = document.getElementById('user').value === OPTIONS.user
+        && document.getElementById('password').value === OPTIONS.password;
+    if (ok) { show(''); conference(); }
+});
+
+setTimeout(() => { if (prejoinEnabled) show('prejoin'); else join(); }, OPTIONS.loadDelayMs);
+</script>
+</body>
+</html>
+"""
+
+
+class StubJitsiServer:
+    """Run the stub server on a background thread."""
+
+    def __init__(self, port: int = 0, auth: bool = False, user: str = 'bot', password: str = 'secret',
+                 bundle_kb: int = 2048, load_delay_ms: int = 200, join_delay_ms: int = 300):
+        """
+        Args:
+            port: Port to listen on, 0 picks a free one.
+            auth: Show the "Authentication required" dialog after the prejoin screen.
+            user, password: Credentials the auth dialog accepts.
+            bundle_kb: Size of the fake Jitsi bundle, served cacheable.
+            load_delay_ms: Time the page takes to "boot" before showing prejoin.
+            join_delay_ms: Time the fake conference takes to come up after joining.
+        """
+        options = {'auth': auth, 'user': user, 'password': password,
+                   'loadDelayMs': load_delay_ms, 'joinDelayMs': join_delay_ms}
+        page = PAGE.replace('__OPTIONS__', json.dumps(options)).encode('utf-8')
+        bundle = b'/* stub bundle */\n' + b'//' + b'x' * 1021 + b'\n'
+        bundle = bundle * max(bundle_kb, 1)
+        self.requests = 0
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                if self.path.startswith('/libs/'):
+                    body, content_type, cache = bundle, 'application/javascript', 'public, max-age=86400'
+                elif self.path == '/favicon.ico':
+                    self.send_error(404)
+                    return
+                else:
+                    body, content_type, cache = page, 'text/html; charset=utf-8', 'no-cache'
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('Cache-Control', cache)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='StubJitsi', daemon=True)
+
+    def start(self) -> 'StubJitsiServer':
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Serve a stub Jitsi meeting page.')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--auth', action='store_true', help='Require login after the prejoin screen.')
+    parser.add_argument('--bundle-kb', type=int, default=2048)
+    args = parser.parse_args()
+    server = StubJitsiServer(port=args.port, auth=args.auth, bundle_kb=args.bundle_kb).start()
+    print(f"Stub Jitsi at {server.url}/<room> (auth: {args.auth}), Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,390 @@
+"""
+Straighten and crop the board from an overhead camera, and feed it to Chromium as a camera.
+
+Runs as its own process, so the per-frame work never holds up the UI or the meeting thread.
+It doesn't log to the app's log file itself: it prints to stdout and stderr, which start()
+passes on to the parent's log.
+
+    python board.py --source /dev/video0 --corners "0.2,0.1 0.8,0.1 0.85,0.95 0.15,0.95" --output /dev/video10
+
+In a meeting the output is a v4l2loopback device, which Chromium lists as a normal camera, so
+the microphone and any other cameras are untouched. Load the module once, e.g.
+`sudo modprobe v4l2loopback video_nr=10 card_label=Board exclusive_caps=1`. A recorded video
+works as --source, and a Y4M file as --output, which is how to try out a calibration or time the
+pipeline away from the Pi:
+
+    python board.py --source game.mp4 --corners "..." --output board.y4m --frames 300
+"""
+import os
+import sys
+import time
+import fcntl
+import ctypes
+import struct
+import argparse
+import threading
+import subprocess
+import numpy as np
+
+# Board corners, as fractions of the camera frame, in this order
+CORNERS = ('top left', 'top right', 'bottom right', 'bottom left')
+
+# Printed by the pipeline process once its first frame is on the output, see start()
+READY_LINE = 'READY'
+
+# Seconds start() waits for READY_LINE: NumPy and OpenCV imports and opening the camera are slow on a Pi
+READY_TIMEOUT = 20.0
+
+
+def parse_corners(text: str) -> list:
+    """
+    Read BOARD_CORNERS: four "x,y" pairs separated by spaces, as fractions of the frame size.
+
+    Returns:
+        list: Four (x, y) tuples, top left first, clockwise.
+
+    Raises:
+        ValueError: If the text isn't four pairs of numbers.
+    """
+    corners = [tuple(float(v) for v in pair.split(',')) for pair in text.split()]
+    if len(corners) != 4 or any(len(c) != 2 for c in corners):
+        raise ValueError(f"Expected 4 x,y corners, got: {text!r}")
+    return corners
+
+
+def format_corners(corners: list) -> str:
+    """ Write corners in the BOARD_CORNERS format. """
+    return ' '.join(f"{x:.4f},{y:.4f}" for x, y in corners)
+
+
+def homography(src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+    """
+    The 3x3 perspective transform taking four `src` points to the four `dst` points.
+
+    Args:
+        src, dst: 4x2 arrays of points.
+
+    Returns:
+        np.ndarray: H, with dst ~ H @ [x, y, 1].
+    """
+    a = np.zeros((8, 8))
+    b = np.zeros(8)
+    for i, ((x, y), (u, v)) in enumerate(zip(src, dst)):
+        a[2 * i] = (x, y, 1, 0, 0, 0, -u * x, -u * y)
+        a[2 * i + 1] = (0, 0, 0, x, y, 1, -v * x, -v * y)
+        b[2 * i], b[2 * i + 1] = u, v
+    return np.append(np.linalg.solve(a, b), 1.0).reshape(3, 3)
+
+
+class BoardWarp:
+    """
+    Map camera frames onto a flat, cropped view of the board.
+
+    The source pixel for every output pixel is worked out once per frame size, by running the
+    whole output grid through the inverse homography in one vectorized step. Each frame is then
+    a single gather of those pixels (nearest neighbour) into a reused output array, so the
+    perspective correction and the crop cost one pass over the output, not the camera frame.
+    """
+
+    def __init__(self, corners: list, width: int, height: int):
+        """
+        Args:
+            corners: Board corners as fractions of the frame, see parse_corners().
+            width, height: Size of the straightened board image.
+        """
+        self.corners = np.array(corners, dtype=np.float64)
+        self.width = width
+        self.height = height
+        self._shape = None
+        self._index = None
+        self._out = np.empty((height, width, 3), dtype=np.uint8)
+
+    def _setup(self, shape: tuple) -> None:
+        frame_height, frame_width = shape[:2]
+        src = self.corners * (frame_width - 1, frame_height - 1)
+        dst = np.array([(0, 0), (self.width - 1, 0), (self.width - 1, self.height - 1), (0, self.height - 1)],
+                       dtype=np.float64)
+        # Output to camera coordinates, for every output pixel at once
+        h = homography(dst, src)
+        ys, xs = np.mgrid[0:self.height, 0:self.width]
+        points = np.stack([xs.ravel(), ys.ravel(), np.ones(xs.size)])
+        mapped = h @ points
+        x = np.clip(np.rint(mapped[0] / mapped[2]), 0, frame_width - 1).astype(np.intp)
+        y = np.clip(np.rint(mapped[1] / mapped[2]), 0, frame_height - 1).astype(np.intp)
+        self._index = y * frame_width + x
+        self._shape = shape
+
+    def __call__(self, frame: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            frame: A height x width x 3 camera frame.
+
+        Returns:
+            np.ndarray: The board, height x width x 3. The array is reused for the next frame.
+        """
+        if frame.shape != self._shape:
+            self._setup(frame.shape)
+        np.take(frame.reshape(-1, 3), self._index, axis=0, out=self._out.reshape(-1, 3))
+        return self._out
+
+
+class Y4MSink:
+    """Write I420 frames to a Y4M file, to check a calibration or the pipeline's speed offline."""
+
+    def __init__(self, path: str, width: int, height: int, fps: int):
+        self.path = path
+        self.header = f"YUV4MPEG2 W{width} H{height} F{fps}:1 Ip A1:1 C420jpeg\n".encode('ascii')
+        self._fd = None
+
+    def open(self) -> None:
+        """ Create the file and write the stream header. """
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.write(self._fd, self.header)
+
+    def write(self, frame: bytes) -> None:
+        """ Write one I420 frame. """
+        if self._fd is None:
+            self.open()
+        os.writev(self._fd, [b'FRAME\n', frame])
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class LoopbackSink:
+    """Write I420 frames to a v4l2loopback device, which Chromium lists as a camera."""
+
+    # V4L2_BUF_TYPE_VIDEO_OUTPUT, V4L2_PIX_FMT_YUV420 ('YU12') and V4L2_FIELD_NONE
+    BUF_TYPE_VIDEO_OUTPUT = 2
+    PIX_FMT_YUV420 = struct.unpack('<I', b'YU12')[0]
+    FIELD_NONE = 1
+
+    def __init__(self, device: str, width: int, height: int):
+        self.device = device
+        self.width = width
+        self.height = height
+        self._fd = None
+
+    def open(self) -> None:
+        """ Open the device and set its format with VIDIOC_S_FMT. """
+        # struct v4l2_format is a u32 type then a 200 byte union, aligned like a pointer
+        align = ctypes.sizeof(ctypes.c_void_p)
+        size = align + 200
+        vidioc_s_fmt = (3 << 30) | (size << 16) | (ord('V') << 8) | 5
+        frame_size = self.width * self.height * 3 // 2
+        fmt = bytearray(size)
+        struct.pack_into('<I', fmt, 0, self.BUF_TYPE_VIDEO_OUTPUT)
+        struct.pack_into('<8I', fmt, align, self.width, self.height, self.PIX_FMT_YUV420, self.FIELD_NONE,
+                         self.width, frame_size, 0, 0)
+        self._fd = os.open(self.device, os.O_WRONLY)
+        fcntl.ioctl(self._fd, vidioc_s_fmt, fmt)
+
+    def write(self, frame: bytes) -> None:
+        if self._fd is None:
+            self.open()
+        os.write(self._fd, frame)
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def make_sink(output: str, width: int, height: int, fps: int):
+    """ A LoopbackSink for /dev/video* outputs, otherwise a Y4MSink. """
+    if output.startswith('/dev/video'):
+        return LoopbackSink(output, width, height)
+    return Y4MSink(output, width, height, fps)
+
+
+def run(source: str, corners: list, sink, width: int, height: int, frames: int = None, fps: float = None,
+        ready=None) -> dict:
+    """
+    Read frames from `source`, straighten and crop the board, and write them to `sink` until the
+    source ends or `frames` frames are written.
+
+    Args:
+        source: Camera device or video file.
+        corners: Board corners, see parse_corners().
+        sink: Y4MSink or LoopbackSink.
+        width, height: Output size, both even.
+        frames: Optional number of frames to stop after.
+        fps: Optional output frame rate. Camera frames in between are grabbed without being
+            decoded or processed, so the warp and convert only run `fps` times a second.
+        ready: Optional callable, called once the first frame is written.
+
+    Returns:
+        dict: 'frames' written, 'seconds' spent, and mean 'warp_ms' and 'convert_ms' per frame.
+    """
+    import cv2
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise OSError(f"Couldn't open {source}")
+    # Keep the driver from queueing frames while a write is slow, so what is sent is current
+    capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    warp = BoardWarp(corners, width, height)
+    i420 = np.empty((height * 3 // 2, width), dtype=np.uint8)
+    count, warp_time, convert_time = 0, 0.0, 0.0
+    started = time.perf_counter()
+    next_frame = started
+    try:
+        while frames is None or count < frames:
+            if fps and time.perf_counter() < next_frame:
+                # Keep the driver's queue moving, so the next frame used is current
+                if not capture.grab():
+                    break
+                continue
+            ok, frame = capture.read()
+            if not ok:
+                break
+            if fps:
+                next_frame = max(next_frame + 1.0 / fps, time.perf_counter())
+            t0 = time.perf_counter()
+            board = warp(frame)
+            t1 = time.perf_counter()
+            cv2.cvtColor(board, cv2.COLOR_BGR2YUV_I420, dst=i420)
+            t2 = time.perf_counter()
+            sink.write(i420.data)
+            warp_time += t1 - t0
+            convert_time += t2 - t1
+            count += 1
+            if count == 1 and ready is not None:
+                ready()
+    finally:
+        capture.release()
+        sink.close()
+    elapsed = time.perf_counter() - started
+    return {'frames': count, 'seconds': elapsed,
+            'warp_ms': warp_time / count * 1000 if count else 0.0,
+            'convert_ms': convert_time / count * 1000 if count else 0.0}
+
+
+def use_output(sessions: list) -> list:
+    """
+    Point the sessions that would film the board at the pipeline's output instead: those whose
+    DEVICE is BOARD_SOURCE, or a single session with no DEVICE, which would get the default camera.
+
+    Args:
+        sessions: Session settings, see jitsi.load_sessions(). Changed in place.
+
+    Returns:
+        list: The same sessions.
+    """
+    for session in sessions:
+        if session['DEVICE'] == session['BOARD_SOURCE'] or (len(sessions) == 1 and not session['DEVICE']):
+            session['DEVICE'] = session['BOARD_OUTPUT']
+    return sessions
+
+
+def start(settings: dict, logs) -> subprocess.Popen:
+    """
+    Start the pipeline in its own process, with the board settings from jitsi.env.
+
+    Args:
+        settings: jitsi.env values, see jitsi.load_settings().
+        logs: Logger to report setup problems to.
+
+    Returns:
+        subprocess.Popen: The pipeline process once its first frame is on the loopback device,
+        or None if it isn't set up, exits, or shows no frame within READY_TIMEOUT.
+    """
+    if settings['BOARD_PIPELINE'] != 'Yes':
+        return None
+    if not settings['BOARD_CORNERS']:
+        logs.error("BOARD_PIPELINE is on, but the board isn't calibrated yet.")
+        return None
+    output = settings['BOARD_OUTPUT']
+    # Chromium's fake capture device would also replace the microphone, so only a loopback camera is supported
+    if not output.startswith('/dev/video') or not os.path.exists(output):
+        logs.error("BOARD_OUTPUT must be a v4l2loopback device such as /dev/video10, not starting the board pipeline: %s",
+                   output)
+        return None
+    # Unbuffered, so its output reaches the log as it happens
+    command = [sys.executable, '-u', os.path.abspath(__file__), '--source', settings['BOARD_SOURCE'],
+               '--corners', settings['BOARD_CORNERS'], '--output', output,
+               '--width', settings['BOARD_WIDTH'], '--height', settings['BOARD_HEIGHT'],
+               '--fps', settings['BOARD_FPS']]
+    logs.info("Starting board pipeline: %s to %s", settings['BOARD_SOURCE'], output)
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    ready = threading.Event()
+    threading.Thread(target=forward_output, args=(process, logs, ready), name='BoardOutput', daemon=True).start()
+
+    # With exclusive_caps, Chromium only lists the loopback camera once frames are flowing, so
+    # joining before then would pin nothing and open the board camera itself
+    started = time.monotonic()
+    deadline = started + READY_TIMEOUT
+    while not ready.wait(0.25):
+        if process.poll() is not None:
+            logs.error("Board pipeline exited before its first frame (status %s)", process.returncode)
+            return None
+        if time.monotonic() >= deadline:
+            logs.error("Board pipeline wrote no frame within %.0fs, stopping it.", READY_TIMEOUT)
+            stop(process, logs)
+            return None
+    logs.info("Board pipeline ready after %.1fs", time.monotonic() - started)
+    return process
+
+
+def forward_output(process: subprocess.Popen, logs, ready: threading.Event = None) -> None:
+    """
+    Log the pipeline process's output from the parent, until it exits. Only one process may
+    write and rotate the log file, so the child never opens it itself. Sets `ready` on READY_LINE.
+    """
+    for line in process.stdout:
+        line = line.rstrip()
+        if line == READY_LINE:
+            if ready is not None:
+                ready.set()
+        elif line:
+            logs.info("Board pipeline: %s", line)
+    process.stdout.close()
+
+
+def stop(process: subprocess.Popen, logs) -> None:
+    """ End a pipeline process started by start(). """
+    if process is None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        logs.error("Board pipeline didn't stop, killing it.")
+        process.kill()
+        process.wait()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Straighten and crop the board from a camera or video file.')
+    parser.add_argument('--source', required=True, help='Camera device or video file.')
+    parser.add_argument('--corners', required=True, help='Four x,y board corners as fractions of the frame.')
+    parser.add_argument('--output', required=True, help='A /dev/video loopback device, or a Y4M file.')
+    parser.add_argument('--width', type=int, default=720)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--fps', type=int, default=15,
+                        help='Frame rate sent to a loopback device, and written in the Y4M header.')
+    parser.add_argument('--frames', type=int, help='Stop after this many frames.')
+    args = parser.parse_args()
+    if args.width % 2 or args.height % 2:
+        parser.error('--width and --height must be even.')
+
+    sink = make_sink(args.output, args.width, args.height, args.fps)
+    # A file is written as fast as the source is read; a live output only needs --fps, and tells
+    # start() once Chromium can see it
+    live = isinstance(sink, LoopbackSink)
+    try:
+        result = run(args.source, parse_corners(args.corners), sink, args.width, args.height, args.frames,
+                     args.fps if live else None, (lambda: print(READY_LINE, flush=True)) if live else None)
+    except KeyboardInterrupt:
+        return 0
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print(f"{result['frames']} frames in {result['seconds']:.1f}s, "
+          f"warp {result['warp_ms']:.2f} ms and convert {result['convert_ms']:.2f} ms per frame")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""Keep a pre-warmed Chromium ready so joining a meeting only has to navigate."""
+import time
+import utilities
+
+
+class Lease:
+    """A browser, context and page handed out by BrowserPool."""
+
+    def __init__(self, browser, context, page, warm: bool):
+        self.browser = browser
+        self.context = context
+        self.page = page
+        self.warm = warm
+
+
+class BrowserPool:
+    """
+    Hold at most one Chromium parked on about:blank.
+
+    Must only be used from the thread that owns the Playwright instance. A parked browser
+    is closed again after `idle_timeout` seconds without a join, to give the memory back.
+    """
+
+    def __init__(self, launch, idle_timeout: float = 600.0):
+        """
+        Args:
+            launch: Callable returning (browser, context, page) with the page on about:blank.
+                browser is None for a persistent context.
+            idle_timeout: Seconds a parked browser may wait for a join before it is closed.
+        """
+        self.launch = launch
+        self.idle_timeout = idle_timeout
+        self.logs = utilities.Logs(app_name='BrowserPool')
+        self._parked = None
+        self._parked_at = 0.0
+
+    @property
+    def is_warm(self) -> bool:
+        """ True if a browser is parked and ready. """
+        return self._parked is not None
+
+    def warm(self) -> None:
+        """ Launch and park a browser in the background, if one isn't parked already. """
+        if self._parked is not None:
+            return
+        started = time.monotonic()
+        try:
+            browser, context, page = self.launch()
+        except Exception as e:
+            self.logs.error("Couldn't pre-warm browser: %s", e)
+            return
+        self._parked = Lease(browser, context, page, warm=True)
+        self._parked_at = time.monotonic()
+        self.logs.info("Browser pre-warmed in %.2fs", self._parked_at - started)
+
+    def acquire(self) -> Lease:
+        """
+        Hand out the parked browser, or cold-launch one if none is parked.
+
+        Returns:
+            Lease: The browser, context and page to join with, and whether it was warm.
+        """
+        lease, self._parked = self._parked, None
+        if lease is not None:
+            try:
+                # A browser that died while parked can't be used, fall back to a cold start
+                if lease.browser is None or lease.browser.is_connected():
+                    return lease
+            except Exception:
+                pass
+            self.logs.error("Parked browser was no longer connected, launching a new one.")
+            self._close(lease)
+        browser, context, page = self.launch()
+        return Lease(browser, context, page, warm=False)
+
+    def release(self, lease: Lease) -> None:
+        """ Close a browser handed out by acquire(). """
+        self._close(lease)
+
+    def expire_if_idle(self) -> None:
+        """ Close the parked browser if it has waited longer than idle_timeout. """
+        if self._parked is not None and time.monotonic() - self._parked_at > self.idle_timeout:
+            self.logs.info("No join for %.0fs, closing pre-warmed browser.", self.idle_timeout)
+            self.close()
+
+    def close(self) -> None:
+        """ Close the parked browser, if any. """
+        lease, self._parked = self._parked, None
+        if lease is not None:
+            self._close(lease)
+
+    def _close(self, lease: Lease) -> None:
+        try:
+            lease.context.close()
+            if lease.browser is not None:
+                lease.browser.close()
+        except Exception as e:
+            self.logs.debug("Error closing browser: %s", e)
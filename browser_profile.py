@@ -0,0 +1,153 @@
+"""Manage the on-disk Chromium profile used to cache the Jitsi web app between joins."""
+import os
+import shutil
+import utilities
+
+# Profile sub-directories that only hold re-downloadable cache data, safe to prune
+CACHE_DIRS = (
+    os.path.join('Default', 'Cache'),
+    os.path.join('Default', 'Code Cache'),
+    os.path.join('Default', 'GPUCache'),
+    os.path.join('Default', 'Service Worker', 'CacheStorage'),
+    os.path.join('Default', 'Service Worker', 'ScriptCache'),
+)
+
+
+def _walk_files(directory: str):
+    """ Yield (path, size, mtime) for every file under a directory. """
+    for root, _dirs, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            yield path, st.st_size, st.st_mtime
+
+
+def size(profile_dir: str) -> int:
+    """
+    Total size of a profile directory.
+
+    Args:
+        profile_dir (str): The path to the profile directory.
+
+    Returns:
+        int: Size in bytes, 0 if the directory does not exist.
+    """
+    return sum(file_size for _path, file_size, _mtime in _walk_files(profile_dir))
+
+
+def prune(profile_dir: str, max_bytes: int) -> dict:
+    """
+    Delete the oldest cache files in a profile until it fits in max_bytes.
+    Only call this while no browser is using the profile.
+
+    Args:
+        profile_dir (str): The path to the profile directory.
+        max_bytes (int): Size cap for the whole profile.
+
+    Returns:
+        dict: Dictionary with keys 'success' and 'result'.
+        'success' is False if an exception occurs.
+        'result' contains the number of bytes freed, or a string of the exception that occurred.
+    """
+    try:
+        total = size(profile_dir)
+        if total <= max_bytes:
+            return {'success': True, 'result': 0}
+        cache_files = []
+        for cache_dir in CACHE_DIRS:
+            cache_files.extend(_walk_files(os.path.join(profile_dir, cache_dir)))
+        cache_files.sort(key=lambda item: item[2])
+        freed = 0
+        for path, file_size, _mtime in cache_files:
+            if total - freed <= max_bytes:
+                break
+            try:
+                os.remove(path)
+                freed += file_size
+            except FileNotFoundError:
+                pass
+        return {'success': True, 'result': freed}
+    except (OSError, IOError) as e:
+        return {'success': False, 'result': str(e)}
+
+
+def clear(profile_dir: str) -> dict:
+    """
+    Delete every cache directory in a profile, keeping cookies and local storage.
+
+    Args:
+        profile_dir (str): The path to the profile directory.
+
+    Returns:
+        dict: Dictionary with keys 'success' and 'result'.
+        'success' is False if an exception occurs.
+        'result' contains the number of bytes freed, or a string of the exception that occurred.
+    """
+    try:
+        freed = 0
+        for cache_dir in CACHE_DIRS:
+            path = os.path.join(profile_dir, cache_dir)
+            freed += size(path)
+            shutil.rmtree(path, ignore_errors=True)
+        return {'success': True, 'result': freed}
+    except (OSError, IOError) as e:
+        return {'success': False, 'result': str(e)}
+
+
+class NetworkStats:
+    """
+    Count cache hits/misses and bytes transferred for a page, via the Chrome DevTools Protocol.
+    Must be used from the thread that owns the page.
+    """
+
+    def __init__(self, page):
+        """
+        Args:
+            page: The Playwright page to watch.
+        """
+        self.logs = utilities.Logs(app_name='NetworkStats')
+        self.reset()
+        self._cdp = page.context.new_cdp_session(page)
+        self._cdp.on('Network.requestServedFromCache', self._on_served_from_cache)
+        self._cdp.on('Network.responseReceived', self._on_response)
+        self._cdp.on('Network.loadingFinished', self._on_finished)
+        self._cdp.send('Network.enable')
+
+    def reset(self) -> None:
+        """ Start counting from zero. """
+        self.hits = 0
+        self.misses = 0
+        self.bytes_transferred = 0
+        self._from_cache = set()
+
+    def _on_served_from_cache(self, params: dict) -> None:
+        self._from_cache.add(params['requestId'])
+
+    def _on_response(self, params: dict) -> None:
+        response = params.get('response', {})
+        if (params['requestId'] in self._from_cache or response.get('fromDiskCache')
+                or response.get('fromPrefetchCache') or response.get('fromServiceWorker')):
+            self.hits += 1
+        else:
+            self.misses += 1
+        self._from_cache.discard(params['requestId'])
+
+    def _on_finished(self, params: dict) -> None:
+        self.bytes_transferred += int(params.get('encodedDataLength', 0))
+
+    def summary(self) -> str:
+        """ One line summary of the counts so far. """
+        total = self.hits + self.misses
+        ratio = (self.hits / total * 100) if total else 0.0
+        return (f"Cache: {self.hits} hits, {self.misses} misses ({ratio:.0f}% hit), "
+                f"{self.bytes_transferred / 1024:.0f} KiB transferred")
+
+    def detach(self) -> None:
+        """ Stop watching the page. """
+        try:
+            self._cdp.detach()
+        except Exception as e:
+            self.logs.debug("Error detaching CDP session: %s", e)
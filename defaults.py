@@ -0,0 +1,86 @@
+"""
+Default values for Settings/global.env and Settings/jitsi.env, in one place.
+
+New settings files are written from these tables, and each module reads its own keys with
+them as defaults, so files written before a key existed keep working. Kept free of heavy
+imports, so the UI can write a new file without loading Playwright, NumPy or OpenCV.
+"""
+from pathlib import Path
+
+# global.env: the app itself
+APP_SETTINGS = {
+    'SETUP_REQUIRED': 'Yes',
+    'APPEARANCE': 'System',
+    'MEETING_SOFTWARE': 'jitsi'
+}
+
+# global.env: the meeting browser, see meeting.MeetingWorker.load_options()
+BROWSER_OPTIONS = {
+    'BROWSER_WARM': 'No',
+    'BROWSER_IDLE_TIMEOUT': '600',
+    'BROWSER_PROFILE': 'No',
+    'BROWSER_PROFILE_DIR': str(Path('Settings/browser-profile')),
+    'BROWSER_PROFILE_MAX_MB': '300'
+}
+
+# global.env: the camera preview, see preview.load_options()
+PREVIEW_OPTIONS = {
+    'PREVIEW': 'Yes',
+    'PREVIEW_DEVICE': '/dev/video0',
+    'PREVIEW_FPS': '10',
+    'PREVIEW_CPU_PERCENT': '25'
+}
+
+# global.env: the metrics endpoint, see metrics.load_options()
+METRICS_OPTIONS = {
+    'METRICS': 'Yes',
+    'METRICS_PORT': '9101',
+    'METRICS_INTERVAL': '10',
+    'METRICS_LOG_INTERVAL': '300',
+    'METRICS_DISK': 'mmcblk0'
+}
+
+# Everything a new global.env is written with
+GLOBAL_SETTINGS = {**APP_SETTINGS, **BROWSER_OPTIONS, **PREVIEW_OPTIONS, **METRICS_OPTIONS}
+
+# jitsi.env: the meeting to join, placeholders until setup fills them in
+JITSI_REQUIRED = {
+    'JITSI_SETUP_REQUIRED': 'Yes',
+    'JITSI_URL': 'NONE',
+    'MEETING_ID': 'NONE',
+    'DISPLAY_NAME': 'A Streamer Bot',
+    'USER_NAME': 'NONE',
+    'USER_PASSWORD': 'NONE'
+}
+
+# jitsi.env: optional keys, defaulted when missing, see jitsi.OPTIONAL_SETTINGS
+JITSI_OPTIONAL = {
+    'FAST_JOIN': 'Yes',
+    'START_AUDIO_MUTED': 'No',
+    'START_VIDEO_MUTED': 'No',
+    'VIDEO_WIDTH': '1280',
+    'VIDEO_HEIGHT': '720',
+    'VIDEO_FPS': '15',
+    'VIDEO_CODEC': 'VP8',
+    'ADAPTIVE_QUALITY': 'Yes',
+    'ENCODE_BUDGET': str(1280 * 720 * 15),
+    'BOARD_PIPELINE': 'No',
+    'BOARD_SOURCE': '/dev/video0',
+    'BOARD_CORNERS': '',
+    'BOARD_WIDTH': '720',
+    'BOARD_HEIGHT': '720',
+    'BOARD_FPS': '15',
+    'BOARD_OUTPUT': '/dev/video10',
+    'RECORD': 'No',
+    'RECORD_INCOMING': 'No',
+    'RECORD_DIR': str(Path('Recordings')),
+    'RECORD_SEGMENT_SECONDS': '300',
+    'RECORD_MIN_FREE_MB': '500',
+    'RECORD_ON_FULL': 'rotate',
+    'REQUEST_FILTER': 'Yes',
+    'REQUEST_ALLOW': '',
+    'REQUEST_DENY': ''
+}
+
+# Everything a new jitsi.env is written with
+JITSI_SETTINGS = {**JITSI_REQUIRED, **JITSI_OPTIONAL}
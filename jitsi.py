@@ -1,14 +1,135 @@
+import json
+import time
+import threading
+import urllib.parse
 import utilities
+import defaults
+import request_filter
 from pathlib import Path
-from playwright.sync_api import Playwright
+from playwright.sync_api import Playwright, Page, TimeoutError as PlaywrightTimeoutError
 
+# States reported through on_state, in the order a normal join goes through them
+STATES = ('launching', 'navigating', 'prejoin', 'auth', 'joined', 'reconnecting', 'failed', 'left')
 
-def run(playwright: Playwright) -> None:
-    # Init logging
-    logs = utilities.logs(app_name='Jitsi')
-    
-    # Pull env values, validate if successful
-    file = str(Path('Settings/jitsi.env'))
+# How long to wait for the conference to come up (or fail) after each step, in miliseconds
+JOIN_TIMEOUT = 30000
+
+# How often a join checks whether it's been asked to leave, in miliseconds
+LEAVE_POLL = 500
+
+# Texts Jitsi shows when a join can't go ahead
+ERROR_TEXTS = ('Unfortunately, something went wrong', 'You have been kicked', 'Meeting has been ended',
+               'The meeting has been terminated', 'Connection failed')
+
+# Resolves to the first of 'joined', 'auth', 'prejoin' or 'error' seen on the page, skipping any in `skip`.
+# Evaluated by wait_for_function, so the join reacts as soon as the page changes instead of on fixed timeouts.
+OUTCOME_JS = """
+({skip, errors}) => {
+    const app = window.APP;
+    if (app && app.conference && app.conference.isJoined && app.conference.isJoined()) return 'joined';
+    const text = document.body ? document.body.innerText : '';
+    if (!skip.includes('auth') && text.includes('Authentication required')) return 'auth';
+    if (errors.some(e => text.includes(e))) return 'error';
+    if (!skip.includes('prejoin')) {
+        const buttons = document.querySelectorAll('button, [role="button"]');
+        for (const b of buttons) {
+            if (b.offsetParent === null) continue;
+            const name = (b.getAttribute('aria-label') || b.innerText || '').toLowerCase();
+            if (name.includes('join meeting')) return 'prejoin';
+        }
+    }
+    return false;
+}
+"""
+
+# Make getUserMedia pick the `index`th camera whose label starts with `label`, for identical cameras
+# that share a label. Labels are only filled in once camera permission is granted, so if none
+# match yet, one throwaway request unlocks them.
+PIN_CAMERA_JS = """
+({label, index}) => {
+    const media = navigator.mediaDevices;
+    if (!media || !label || media.__streambotCamera) return;
+    media.__streambotCamera = label;
+    const getUserMedia = media.getUserMedia.bind(media);
+    let deviceId = null;
+    const find = async () => (await media.enumerateDevices())
+        .filter(d => d.kind === 'videoinput' && d.label.startsWith(label))[index];
+    const resolve = async () => {
+        if (deviceId) return deviceId;
+        let match = await find();
+        if (!match) {
+            const stream = await getUserMedia({video: true});
+            stream.getTracks().forEach(t => t.stop());
+            match = await find();
+        }
+        deviceId = match ? match.deviceId : null;
+        return deviceId;
+    };
+    media.getUserMedia = async (constraints) => {
+        if (constraints && constraints.video) {
+            const id = await resolve();
+            if (id) {
+                const video = typeof constraints.video === 'object' ? constraints.video : {};
+                constraints = Object.assign({}, constraints, {video: Object.assign({}, video, {deviceId: {exact: id}})});
+            }
+        }
+        return getUserMedia(constraints);
+    };
+}
+"""
+
+SETTINGS_FILE = str(Path('Settings/jitsi.env'))
+
+# Sections of jitsi.env that each describe one camera participant, e.g. [CAMERA board]
+CAMERA_SECTION = 'CAMERA'
+
+# Optional jitsi.env keys, and their defaults for files written before they existed
+OPTIONAL_SETTINGS = defaults.JITSI_OPTIONAL
+
+# The --use-fake-ui-for-media-stream prevents the popup for permissions to access camera and video.
+# Audio needs no click to start either, so recording can mix in the other participants' audio.
+LAUNCH_ARGS = ["--use-fake-ui-for-media-stream", "--autoplay-policy=no-user-gesture-required"]
+
+
+def launch(playwright: Playwright, profile_dir: str = None, extra_args: list = None) -> tuple:
+    """
+    Launch Chromium for a meeting and open a page parked on about:blank.
+
+    Args:
+        playwright: A sync Playwright instance, owned by the calling thread.
+        profile_dir: Optional persistent profile directory. Keeping the profile keeps the
+            HTTP cache, service workers and local storage, so repeat joins skip re-downloading
+            the Jitsi bundle.
+        extra_args: Optional Chromium flags added to LAUNCH_ARGS.
+
+    Returns:
+        tuple: (browser, context, page). browser is None for a persistent profile,
+        closing the context closes the browser.
+    """
+    args = LAUNCH_ARGS + list(extra_args or [])
+    # You can disable headless mode for debugging (Or if you want the meeting window to be visible)
+    if profile_dir:
+        context = playwright.chromium.launch_persistent_context(profile_dir, headless=True, args=args)
+        page = context.pages[0] if context.pages else context.new_page()
+        return None, context, page
+    browser = playwright.chromium.launch(headless=True, args=args)
+    context = browser.new_context()
+    page = context.new_page()
+    return browser, context, page
+
+
+def load_settings(logs, section: str = 'DEFAULT') -> dict:
+    """
+    Pull the meeting settings from the cached Settings/jitsi.env snapshot.
+
+    Args:
+        logs: Logger to report missing keys to.
+        section: Section to read. Camera sections inherit anything they don't set from DEFAULT.
+
+    Returns:
+        dict: Required keys ('' if missing) and OPTIONAL_SETTINGS (defaulted if missing).
+    """
+    file = SETTINGS_FILE
     settings = {
         'DISPLAY_NAME': '',
         'USER_NAME': '',
@@ -16,74 +137,340 @@ def run(playwright: Playwright) -> None:
         'JITSI_URL': '',
         'MEETING_ID': ''
     }
-    # Fetch value for each key from settings, then add to dictionary
-    for item in settings:
-        logs.debug(f"Searching for: {item}")
-        y = utilities.env.load(file, item)
-        if y['success']:
-            logs.debug(f"Found {item} from .ENV")
-            logs.debug(f"Setting {item}")
-            settings[item] = y['result']
-        else:
-            logs.error(f"Couldn't find value of {item}!")
+    settings.update(OPTIONAL_SETTINGS)
+    y = utilities.Settings.get_many(file, settings, section=section)
+    if y['success']:
+        logs.debug("Found %s from .ENV", ', '.join(y['result']))
+        settings.update(y['result'])
+        for item in [item for item in y['missing'] if item not in OPTIONAL_SETTINGS]:
+            logs.error("Couldn't find value of %s!", item)
+    else:
+        logs.error("Couldn't load %s: %s", file, y['result'])
+    return settings
+
+
+def load_sessions(logs) -> list:
+    """
+    Settings for each camera to join with. Every [CAMERA <name>] section in jitsi.env is one
+    participant, with its own DEVICE (e.g. /dev/video2) and DISPLAY_NAME. Without camera
+    sections there is one session, using the DEFAULT section and the browser's default camera.
+
+    Args:
+        logs: Logger to report missing keys to.
+
+    Returns:
+        list: Settings dicts as from load_settings(), with 'SESSION' and 'DEVICE' added.
+    """
+    x = utilities.Settings.get_sections(SETTINGS_FILE)
+    cameras = [s for s in x['result'] if s.startswith(CAMERA_SECTION)] if x['success'] else []
+    if not cameras:
+        settings = load_settings(logs)
+        settings.update({'SESSION': 'main', 'DEVICE': ''})
+        return [settings]
+    sessions = []
+    for section in cameras:
+        settings = load_settings(logs, section)
+        device = utilities.Settings.load(SETTINGS_FILE, section, 'DEVICE')
+        settings['SESSION'] = section[len(CAMERA_SECTION):].strip() or section
+        settings['DEVICE'] = device['result'] if device['success'] else ''
+        sessions.append(settings)
+    return sessions
+
+
+def device_label(device: str) -> str:
+    """
+    The name the kernel gives a V4L2 device, which Chromium uses as the start of its camera label.
+
+    Args:
+        device: Device path, e.g. /dev/video0, or a link to one such as /dev/v4l/by-path/...
+
+    Returns:
+        str: The name, or '' if it can't be read.
+    """
+    path = Path('/sys/class/video4linux') / Path(device).resolve().name / 'name'
+    try:
+        return path.read_text(encoding='utf-8').strip()
+    except (OSError, IOError):
+        return ''
+
+
+def device_index(device: str) -> tuple:
+    """
+    Tell apart cameras of the same model, which share a label: which of the capture devices
+    with `device`'s label it is, counting in /dev/videoN order, the order Chromium lists them in.
+    Metadata nodes (a second /dev/video per UVC camera, with a V4L2 index above 0) aren't counted.
+
+    Args:
+        device: Device path, see device_label().
+
+    Returns:
+        tuple: (index, count), count being how many cameras share the label. (0, 0) if unknown.
+    """
+    label = device_label(device)
+    name = Path(device).resolve().name
+    nodes = []
+    for node in Path('/sys/class/video4linux').glob('video*'):
+        try:
+            if (node / 'name').read_text(encoding='utf-8').strip() != label:
+                continue
+            index = node / 'index'
+            if index.exists() and index.read_text(encoding='utf-8').strip() != '0':
+                continue
+            nodes.append((int(node.name[len('video'):]), node.name))
+        except (OSError, IOError, ValueError):
+            continue
+    names = [node for _number, node in sorted(nodes)]
+    if not label or name not in names:
+        return 0, 0
+    return names.index(name), len(names)
+
+
+def camera_script(label: str, index: int = 0) -> str:
+    """
+    Init script that makes every getUserMedia video request on the page use the camera with `label`.
+
+    Args:
+        label: Start of the camera's label, see device_label().
+        index: Which of the cameras with that label to use, see device_index().
+
+    Returns:
+        str: Script for page.add_init_script().
+    """
+    return f"({PIN_CAMERA_JS})({json.dumps({'label': label, 'index': index})});"
+
+
+def run(page: Page, leave: threading.Event, on_state=None, on_tick=None) -> None:
+    """
+    Join the Jitsi meeting from Settings/jitsi.env and stay in it until `leave` is set.
+    The caller owns the page's browser and context, and closes them afterwards.
+
+    Args:
+        page: A blank page to join from, see launch().
+        leave: Event that ends the meeting when set (e.g. from the UI's Leave button).
+        on_state: Optional callable(state, detail) told about each entry in STATES.
+        on_tick: Optional callable(page) run about every 500ms while in the meeting, on this thread.
+    """
+    report = on_state or (lambda state, detail='': None)
+
+    # Init logging
+    logs = utilities.Logs(app_name='Jitsi')
     
+    # Pull env values from the cached settings snapshot
+    settings = load_settings(logs)
+    if not join(page, settings, report, logs, leave):
+        return
+    report('joined')
+
+    # Keep it open until we're told to leave. Waiting through the page keeps Playwright's events flowing.
+    while not leave.is_set():
+        page.wait_for_timeout(500)
+        if on_tick is not None:
+            on_tick(page)
+    logs.info("Left meeting.")
+
+
+def join(page: Page, settings: dict, report, logs, leave: threading.Event = None) -> bool:
+    """
+    Navigate a page to the meeting and get it into the conference.
+
+    Args:
+        page: A blank page to join from.
+        settings: Values from jitsi.env, see load_settings().
+        report: Callable(state, detail) told about each step up to, but not including, 'joined'.
+        logs: Logger for this session.
+        leave: Optional event that cancels the join when set, checked between steps and
+            every LEAVE_POLL while waiting on the page.
+
+    Returns:
+        bool: True once joined, False if joining failed (after reporting 'failed') or was cancelled.
+    """
     # Fetch values for keys from dictionary for use
     display_name = settings['DISPLAY_NAME']
     user_name = settings['USER_NAME']
     user_password = settings['USER_PASSWORD']
-    meeting_base = settings['JITSI_URL']
-    meeting_id = settings['MEETING_ID']
-    meeting_url = f"{meeting_base}/{meeting_id}"
+    meeting_url = build_url(settings)
+
+    # Block analytics, fonts, avatars, blur models and welcome page assets before anything loads
+    filtered = request_filter.attach(page, settings, logs)
+    try:
+        return navigate(page, meeting_url, display_name, user_name, user_password, report, logs, leave)
+    finally:
+        if filtered is not None:
+            filtered.log_join()
 
-    # Initialize the browser. The --use-fake-ui-for-media-stream prevents the popup for permissions to access camera and video.
-    # You can disable headless mode for debugging (Or if you want the meeting window to be visible)
-    browser = playwright.chromium.launch(headless=True, args=["--use-fake-ui-for-media-stream"])
-    context = browser.new_context()
-    page = context.new_page()
+
+def navigate(page: Page, meeting_url: str, display_name: str, user_name: str, user_password: str,
+             report, logs, leave: threading.Event = None) -> bool:
+    """ Open the meeting URL and step through prejoin and auth until joined, see join(). """
+    if leave is not None and leave.is_set():
+        logs.info("Join cancelled.")
+        return False
 
     # Navigate to meeting URL
-    page.goto(meeting_url)
-    logs.info(f"Opened meeting URL: {meeting_url}")
+    report('navigating', meeting_url)
+    try:
+        page.goto(meeting_url)
+    except Exception as e:
+        logs.error("Couldn't open meeting URL: %s", e)
+        report('failed', str(e))
+        return False
+    logs.info("Opened meeting URL: %s", meeting_url)
+
+    # React to whatever the page shows next until we're in the conference. With FAST_JOIN the
+    # prejoin screen is skipped by the URL config, otherwise it's filled in by scraping.
+    handled = []
+    while True:
+        outcome, error = wait_for_outcome(page, handled, leave=leave)
+        if outcome == 'joined':
+            break
+        if outcome == 'left':
+            logs.info("Join cancelled.")
+            return False
+        if outcome == 'prejoin':
+            handled.append('prejoin')
+            report('prejoin')
+            fill_prejoin(page, display_name, logs)
+        elif outcome == 'auth':
+            handled.append('auth')
+            logs.debug("Login is required.")
+            report('auth')
+            fill_auth(page, user_name, user_password, logs)
+        else:
+            if outcome == 'page_error':
+                detail = f"The meeting page failed: {error}"
+            elif outcome == 'error':
+                detail = 'Jitsi showed an error.'
+            else:
+                detail = 'Timed out joining the conference.'
+            logs.error(detail)
+            report('failed', detail)
+            return False
 
-    # Find and fill in Displayname, click join
+    logs.info("Joined meeting!")
+    return True
+
+
+def build_url(settings: dict) -> str:
+    """
+    Build the meeting URL. Jitsi config fragments set the capture constraints, codec and start
+    muted settings, and unless FAST_JOIN is 'No', skip the prejoin screen and preset the display name.
+
+    Args:
+        settings: Values from jitsi.env, see load_settings().
+
+    Returns:
+        str: The URL to open.
+    """
+    meeting_url = f"{settings['JITSI_URL']}/{settings['MEETING_ID']}"
+    options = dict(OPTIONAL_SETTINGS)
+    options.update(settings)
+    width, height, fps = int(options['VIDEO_WIDTH']), int(options['VIDEO_HEIGHT']), int(options['VIDEO_FPS'])
+    config = {
+        'config.resolution': height,
+        'config.constraints.video.width.ideal': width,
+        'config.constraints.video.width.max': width,
+        'config.constraints.video.height.ideal': height,
+        'config.constraints.video.height.max': height,
+        'config.constraints.video.frameRate.max': fps,
+        'config.videoQuality.preferredCodec': options['VIDEO_CODEC'],
+        # Always set, the prejoin screen honours them too, and extra camera sessions rely on starting muted
+        'config.startWithAudioMuted': options['START_AUDIO_MUTED'] == 'Yes',
+        'config.startWithVideoMuted': options['START_VIDEO_MUTED'] == 'Yes',
+    }
+    if options['FAST_JOIN'] != 'No':
+        config.update({
+            'config.prejoinConfig.enabled': False,
+            'config.prejoinPageEnabled': False,
+            'userInfo.displayName': options['DISPLAY_NAME'],
+        })
+    fragment = '&'.join(f"{key}={urllib.parse.quote(json.dumps(value))}" for key, value in config.items())
+    return f"{meeting_url}#{fragment}"
+
+
+def wait_for_outcome(page: Page, skip: list, timeout: int = JOIN_TIMEOUT, leave: threading.Event = None):
+    """
+    Wait for the first of 'joined', 'auth', 'prejoin' or 'error' to show on the page.
+
+    Args:
+        page: The meeting page.
+        skip: Outcomes already handled, which are not reported again.
+        timeout: Miliseconds to wait.
+        leave: Optional event that ends the wait early when set, checked every LEAVE_POLL.
+
+    Returns:
+        tuple: (outcome, message). The outcome is one of the above, 'left' if `leave` was set,
+        'page_error' if the page itself failed (e.g. it crashed or closed), with the error as
+        the message, or None on timeout. The message is '' for everything but 'page_error'.
+    """
+    arg = {'skip': skip, 'errors': list(ERROR_TEXTS)}
+    deadline = time.monotonic() + timeout / 1000
+    while True:
+        if leave is not None and leave.is_set():
+            return 'left', ''
+        remaining = int((deadline - time.monotonic()) * 1000)
+        if remaining <= 0:
+            return None, ''
+        wait = remaining if leave is None else min(remaining, LEAVE_POLL)
+        try:
+            handle = page.wait_for_function(OUTCOME_JS, arg=arg, polling=100, timeout=wait)
+            return handle.json_value(), ''
+        except PlaywrightTimeoutError:
+            continue
+        except Exception as e:
+            return 'page_error', str(e).splitlines()[0] if str(e) else type(e).__name__
+
+
+def conference_state(page: Page):
+    """
+    Check, without waiting, whether the page is still in the conference.
+
+    Args:
+        page: The meeting page.
+
+    Returns:
+        str: 'joined', 'error' if Jitsi shows one of ERROR_TEXTS, or None if neither.
+    """
+    return page.evaluate(OUTCOME_JS, {'skip': ['auth', 'prejoin'], 'errors': list(ERROR_TEXTS)}) or None
+
+
+def fill_prejoin(page: Page, display_name: str, logs) -> None:
+    """ Fill in Displayname on the prejoin screen, then click join. """
+    fill_name(page, display_name, logs)
+    click_join(page, logs)
+
+
+def fill_name(page: Page, display_name: str, logs) -> None:
+    """ Find and fill in Displayname on the prejoin screen. """
     try:
         logs.debug("Searching for display name field.")
         page.get_by_role("textbox", name="Enter your name").fill(display_name)
-        logs.debug(f"Typed: {display_name}.")
+        logs.debug("Typed: %s.", display_name)
     except Exception as e:
-        logs.debug(f"Couldn't complete step display name: {e}")
-    
+        logs.debug("Couldn't complete step display name: %s", e)
+
+
+def click_join(page: Page, logs) -> None:
+    """ Click join on the prejoin screen. """
     try:
         logs.debug("Searching for Join Meeting button")
         page.get_by_role("button", name="Join Meeting").click()
         logs.debug("Clicked join meeting button.")
         logs.info("Joining meeting!")
     except Exception as e:
-        logs.error(f"Couldn't complete step join meeting: {e}")
-    
-    # Handle user auth prompt, if required. Timeout is in miliseconds. If not visible, no auth required.
+        logs.error("Couldn't complete step join meeting: %s", e)
+
+
+def fill_auth(page: Page, user_name: str, user_password: str, logs) -> None:
+    """ Fill in and submit the user auth prompt. """
     try:
-        message = page.wait_for_selector("text=Authentication required", timeout=10000)
-        if message and message.is_visible():
-            logs.debug("Login is required.")
-            try:
-                logs.debug("Searching for user name field.")
-                page.get_by_placeholder("User identifier").fill(user_name)
-                logs.debug(f"Typed: {user_name}")
-                logs.debug("Searching for user password field.")
-                page.get_by_placeholder("Password").fill(user_password)
-                logs.debug("Typed provided password.")
-                logs.debug("Searching for login button.")
-                page.get_by_role("button", name="Login").click()
-                logs.debug("Clicked login button.")
-            except Exception as e:
-                logs.error(f"Couldn't complete step user authorization: {e}")
-        else:
-            logs.debug("No auth required.")
+        logs.debug("Searching for user name field.")
+        page.get_by_placeholder("User identifier").fill(user_name)
+        logs.debug("Typed: %s", user_name)
+        logs.debug("Searching for user password field.")
+        page.get_by_placeholder("Password").fill(user_password)
+        logs.debug("Typed provided password.")
+        logs.debug("Searching for login button.")
+        page.get_by_role("button", name="Login").click()
+        logs.debug("Clicked login button.")
     except Exception as e:
-        print(f'Error occurred during auth step: {e}')
-    
-    # Keep it open until we're done with it :)
-    input()
-    context.close()
-    browser.close()
\ No newline at end of file
+        logs.error("Couldn't complete step user authorization: %s", e)
@@ -1,59 +1,79 @@
-import customtkinter, utilities, jitsi
+import os
+import time
+import queue
+import tkinter
+
+# Taken before the heavier imports, in case the process start time can't be read
+MAIN_STARTED = time.time()
+
+import customtkinter, utilities, defaults
 from pathlib import Path
-from playwright.sync_api import sync_playwright
+# meeting (and Playwright with it) is imported on first use, see App.ensure_meeting(), and
+# preview (NumPy and OpenCV) after the first frame, see App.start_preview()
+
+
+def process_start_time() -> float:
+    """ Wall clock time the process started, from /proc. Falls back to when main.py started. """
+    try:
+        with open('/proc/self/stat', 'r', encoding='utf-8') as f:
+            # Fields after the ')' that closes the command name; starttime is field 22 overall
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/stat', 'r', encoding='utf-8') as f:
+            boot_time = next(int(line.split()[1]) for line in f if line.startswith('btime'))
+        return boot_time + start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, IOError, ValueError, IndexError, StopIteration):
+        return MAIN_STARTED
+
+
+class StartupTrace:
+    """Time each startup phase from process start, so startup regressions show up in the log."""
+
+    def __init__(self):
+        self.start = process_start_time()
+        self.last = self.start
+        self.phases = []
+
+    def mark(self, phase: str) -> None:
+        """ End the current phase, naming it. """
+        now = time.time()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def summary(self) -> str:
+        """ One line with each phase's duration and the total. """
+        phases = ', '.join(f"{phase} {elapsed:.2f}s" for phase, elapsed in self.phases)
+        return f"{phases}, total {self.last - self.start:.2f}s"
+
 
 class App(customtkinter.CTk):
+    # Seconds to wait on close for the meeting worker to leave and clean up: stop the board
+    # pipeline, finish the recording and flush the stats
+    SHUTDOWN_TIMEOUT = 15.0
+
     def __init__(self, *args, **kwargs):
+        self.trace = StartupTrace()
+        self.trace.mark('process start to imports')
         super().__init__(*args, **kwargs)
         self.title("PyStreamer Bot")
         self.geometry("800x480")
         
         # Initialize logging
-        self.logs = utilities.logs(app_name="Main-UI")
-        # Check if global.env exists, create if not and set defaults
+        self.logs = utilities.Logs(app_name="Main-UI")
+        self.trace.mark('logging')
         self.global_env = str(Path('Settings/global.env'))
-        x = utilities.files.check_exist(self.global_env)
-        # If file already exist
-        if x['success'] and x['result']:
-            self.logs.debug(f'File exists: {self.global_env}')
-        # If file is not found, create it
-        elif x['success'] and not x['result']:
-            y = utilities.files.create(self.global_env)
-            # Check if creation was successful
-            match y['success']:
-                # If file was created, add default settings
-                case True: 
-                    self.logs.debug(f"File created: {self.global_env}")
-
-                    settings = {
-                        'SETUP_REQUIRED': 'Yes',
-                        'APPEARANCE': 'System',
-                        'MEETING_SOFTWARE': 'jitsi'
-                    }
-
-                    for key, value in settings.items():
-                        z = utilities.env.write(self.global_env, key, value)
-                        if z['success']:
-                            self.logs.debug(f"Set {key} = {value} in {self.global_env}")
-                        else:
-                            self.logs.error(f"Couldn't write {key} = {value} in {self.global_env}")
-                            self.logs.error(f"{z['result']}")
-                case False: 
-                    self.logs.error(f"Error creating file: {y['result']}")
-        # If there was an exception, log it
-        else:
-            self.logs.error(x['result'])
-
         # Set location for env files for meeting software (Currently only Jitsi, may expand to more)
-        self.jitsi_env = str(Path('Settings/jitsi.env'))        
-        
-        # Load global appearance, set System if errors loading
-        x = utilities.env.load(self.global_env, 'APPEARANCE')
+        self.jitsi_env = str(Path('Settings/jitsi.env'))
+
+        # Load global appearance, set System if errors loading (e.g. on first boot, before bootstrap() has run)
+        x = utilities.Settings.load(self.global_env, 'DEFAULT', 'APPEARANCE')
         if x['success']:
-            self.logs.debug(f"Loaded {self.global_env}")
+            self.logs.debug("Loaded %s", self.global_env)
             self.default_appearance = x['result']
         else:
-            self.logs.critical(x['result'])
+            self.logs.debug(x['result'])
+            self.default_appearance = 'System'
+        customtkinter.set_appearance_mode(self.default_appearance)
+        self.trace.mark('settings')
 
         # Frame for the options on left side of screen.
         self.sidebar_frame = customtkinter.CTkFrame(self, width=120, corner_radius=0)
@@ -70,71 +90,274 @@ class App(customtkinter.CTk):
         self.sidebar_dropdown_1.set(str(self.default_appearance))
         self.sidebar_dropdown_1.grid(row=3, column=0, padx=20, pady=20)
 
+        self.sidebar_status = customtkinter.CTkLabel(self.sidebar_frame, text="Not in a meeting")
+        self.sidebar_status.grid(row=4, column=0, padx=20, pady=(20, 5), sticky="s")
+
+        self.sidebar_stats = customtkinter.CTkLabel(self.sidebar_frame, text="", justify="left")
+        self.sidebar_stats.grid(row=5, column=0, padx=20, pady=(5, 20))
+
+        # Main area, showing the camera preview once bootstrap() has started it
+        self.grid_columnconfigure(1, weight=1)
+        self.grid_rowconfigure(3, weight=1)
+        self.preview_frame = customtkinter.CTkFrame(self, corner_radius=0, fg_color="black")
+        self.preview_frame.grid(row=0, column=1, rowspan=4, sticky="nsew")
+        self.preview_label = tkinter.Label(self.preview_frame, bd=0, bg="black", fg="gray", text="No camera preview")
+        self.preview_label.pack(expand=True, fill="both")
+        self.preview = None
+        self.preview_image = None
+        self.metrics = None
+        self.trace.mark('widgets')
+
+        # The browser session runs in a worker thread, and reports back through a queue polled from the Tk loop.
+        # The worker is only created when first needed, so Playwright isn't imported at startup.
+        self.meeting_events = queue.Queue()
+        self.meeting = None
+        self.after(100, self.poll_meeting_events)
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        # after_idle runs once the window is drawn by mainloop, then the nested after(0) runs on the next turn
+        self.after_idle(lambda: self.after(0, self.bootstrap))
+
+    def bootstrap(self):
+        """ Config file checks and writes, done after the first frame so the window shows up straight away. """
+        self.trace.mark('first frame')
+        self.logs.info("Startup: %s", self.trace.summary())
+
+        # Check if global.env exists, create if not and set defaults
+        x = utilities.Files.check_exist(self.global_env)
+        # If file already exist
+        if x['success'] and x['result']:
+            self.logs.debug('File exists: %s', self.global_env)
+        # If file is not found, create it
+        elif x['success'] and not x['result']:
+            y = utilities.Files.create(self.global_env)
+            # Check if creation was successful
+            match y['success']:
+                # If file was created, add default settings
+                case True: 
+                    self.logs.debug("File created: %s", self.global_env)
+
+                    settings = defaults.GLOBAL_SETTINGS
+
+                    # Write all defaults in a single atomic transaction
+                    with utilities.Settings.transaction(self.global_env) as tx:
+                        for key, value in settings.items():
+                            tx.set(key, value)
+                    if tx.result['success']:
+                        self.logs.debug("Set %s in %s", settings, self.global_env)
+                    else:
+                        self.logs.error("Couldn't write %s in %s", settings, self.global_env)
+                        self.logs.error("%s", tx.result['result'])
+                case False: 
+                    self.logs.error("Error creating file: %s", y['result'])
+        # If there was an exception, log it
+        else:
+            self.logs.error(x['result'])
+
         # Call init_options to make sure the appropriate files are in place, and fetch options for UI
         self.init_options()
 
+        # Pre-warming the browser needs the meeting worker up front
+        x = utilities.Settings.load(self.global_env, 'DEFAULT', 'BROWSER_WARM')
+        if x['success'] and x['result'] == 'Yes':
+            self.ensure_meeting()
+        self.start_preview()
+        self.start_metrics()
+        self.trace.mark('bootstrap')
+        self.logs.debug("Bootstrap: %s", self.trace.summary())
+
+    def ensure_meeting(self):
+        """ Import the meeting backend and start its worker on first use. """
+        if self.meeting is None:
+            import meeting
+            self.meeting = meeting.MeetingWorker(self.meeting_events)
+            self.meeting.start()
+        return self.meeting
+
+    def start_metrics(self):
+        """ Start sampling resource use, served on a local /metrics endpoint and logged. """
+        import metrics
+        options = metrics.load_options(self.global_env, self.logs)
+        if options['enabled']:
+            self.metrics = metrics.MetricsCollector(options['port'], options['interval'], options['log_interval'],
+                                                    options['disk'])
+            self.metrics.start()
+
+    def start_preview(self):
+        """ Start the camera preview in the main area, if it's enabled and OpenCV is installed. """
+        try:
+            import preview
+        except ImportError as e:
+            self.logs.info("Camera preview unavailable: %s", e)
+            return
+        options = preview.load_options(self.global_env, self.logs)
+        if not options['enabled']:
+            return
+        width, height = self.preview_label.winfo_width(), self.preview_label.winfo_height()
+        # Before the first layout pass the label reports 1x1, fall back to the panel minus the sidebar
+        if width <= 1 or height <= 1:
+            width, height = preview.CAPTURE_SIZE
+        self.preview_slot = preview.FrameSlot()
+        self.preview_downscaler = preview.Downscaler(width, height)
+        self.preview = preview.CameraPreview(options['device'], self.preview_slot, self.preview_downscaler,
+                                             options['fps'], options['cpu_percent'])
+        self.preview_interval = int(1000 / options['fps'])
+        self.preview_label.bind("<Configure>", lambda event: self.preview_downscaler.resize(event.width, event.height))
+        self.preview.start()
+        self.preview.resume()
+        self.after(self.preview_interval, self.poll_preview)
+
+        # Board corners for the board pipeline are tapped on the preview, see calibrate_board()
+        self.board_corners = None
+        self.sidebar_button_3 = customtkinter.CTkButton(self.sidebar_frame, text="Calibrate Board", command=self.calibrate_board)
+        self.sidebar_button_3.grid(row=6, column=0, padx=20, pady=(0, 20))
+
+    def calibrate_board(self):
+        """ Start taking the four board corners from taps on the preview. """
+        if self.preview_image is None:
+            self.logs.error("Can't calibrate the board without a camera preview.")
+            return
+        self.board_corners = []
+        self.preview_label.bind("<Button-1>", self.calibrate_tap)
+        self.sidebar_status.configure(text="Tap the board's top left corner")
+
+    def calibrate_tap(self, event):
+        # The image is centred in the label, turn the tap into a fraction of the camera frame
+        import board
+        image_width, image_height = self.preview_image.width(), self.preview_image.height()
+        left = (self.preview_label.winfo_width() - image_width) // 2
+        top = (self.preview_label.winfo_height() - image_height) // 2
+        x = min(max((event.x - left) / image_width, 0.0), 1.0)
+        y = min(max((event.y - top) / image_height, 0.0), 1.0)
+        self.board_corners.append((x, y))
+        if len(self.board_corners) < len(board.CORNERS):
+            self.sidebar_status.configure(text=f"Tap the board's {board.CORNERS[len(self.board_corners)]} corner")
+            return
+        self.preview_label.unbind("<Button-1>")
+        corners = board.format_corners(self.board_corners)
+        with utilities.Settings.transaction(self.jitsi_env) as tx:
+            tx.set('BOARD_CORNERS', corners)
+        if tx.result['success']:
+            self.logs.info("Board calibrated: %s", corners)
+            self.sidebar_status.configure(text="Board calibrated")
+        else:
+            self.logs.error("Couldn't save board corners: %s", tx.result['result'])
+            self.sidebar_status.configure(text="Calibration not saved")
+
+    def poll_preview(self):
+        # Show the newest frame, if there is one. Older frames were already dropped by the slot.
+        frame = self.preview_slot.take()
+        if frame is not None:
+            if self.preview_image is None:
+                self.preview_image = tkinter.PhotoImage(data=frame, format="PPM")
+                self.preview_label.configure(image=self.preview_image, text="")
+            else:
+                self.preview_image.configure(data=frame)
+        self.after(self.preview_interval, self.poll_preview)
+
+    def pause_preview(self):
+        """ Release the camera for the meeting, so Chromium can open it and its encoder has the CPU. """
+        if self.preview is not None:
+            if not self.preview.pause():
+                self.logs.error("Camera preview didn't release the camera in time.")
+            self.preview_label.configure(image="", text="Camera in use by the meeting")
+            self.preview_image = None
+
+    def resume_preview(self):
+        if self.preview is not None:
+            self.preview.resume()
 
     def sidebar_button_event(self):
         self.logs.debug("Sidebar button pressed, functionality TBD")
         
     def set_appearance(self, new_appearance: str):
         self.logs.debug("Appearance dropdown menu used")
-        self.logs.debug(f"Setting appearance to: {new_appearance}")
+        self.logs.debug("Setting appearance to: %s", new_appearance)
         customtkinter.set_appearance_mode(new_appearance)
-        x = utilities.env.write(self.global_env, 'APPEARANCE', new_appearance)
-        if x['success']:
-            self.logs.debug(f"Successfully updated to appearance: {new_appearance}")
-        else:
-            self.logs.error(f"Couldn't update appearance in {self.global_env}")
-            self.logs.error(x['result'])
+        # Coalesce rapid changes so the SD card sees one write, flushed shortly after the last change
+        utilities.Settings.write_later(self.global_env, 'APPEARANCE', new_appearance)
+        self.logs.debug("Queued appearance update: %s", new_appearance)
     
     def init_options(self):
-        self.logs.debug(f"Setting appearance: {self.default_appearance}")
-        customtkinter.set_appearance_mode(self.default_appearance)
-        x = utilities.env.load(self.global_env, 'MEETING_SOFTWARE')
-        y = utilities.files.check_exist(self.jitsi_env)
+        x = utilities.Settings.load(self.global_env, 'DEFAULT', 'MEETING_SOFTWARE')
+        y = utilities.Files.check_exist(self.jitsi_env)
         
         # If MEETING_SOFTWARE is jitsi, and the env file does not exist, create it
-        self.logs.debug(f"Software: {x['result']}.")
-        self.logs.debug(f"Env file exists: {y['result']}")
+        self.logs.debug("Software: %s.", x['result'])
+        self.logs.debug("Env file exists: %s", y['result'])
         if x['result'] == 'jitsi' and y['result'] != True:
-            jitsi_settings = {
-            'JITSI_SETUP_REQUIRED': 'Yes',
-            'JITSI_URL': 'NONE',
-            'MEETING_ID': 'NONE',
-            'DISPLAY_NAME': 'A Streamer Bot',
-            'USER_NAME': 'NONE',
-            'USER_PASSWORD': 'NONE'
-            }
-            # Loop through settings and try to set them in ENV file
-            for key, value in jitsi_settings.items():
-                z = utilities.env.write(self.jitsi_env, key, value)
-                if z['success']:
-                    self.logs.debug(f"Set {key} = {value} in {self.jitsi_env}")
-                else:
-                    self.logs.error(f"Couldn't write {key} = {value} in {self.jitsi_env}")
-                    self.logs.error(f"{z['result']}")
+            jitsi_settings = defaults.JITSI_SETTINGS
+            # Set them in the ENV file with a single atomic transaction
+            with utilities.Settings.transaction(self.jitsi_env) as tx:
+                for key, value in jitsi_settings.items():
+                    tx.set(key, value)
+            if tx.result['success']:
+                self.logs.debug("Set %s in %s", jitsi_settings, self.jitsi_env)
+            else:
+                self.logs.error("Couldn't write %s in %s", jitsi_settings, self.jitsi_env)
+                self.logs.error("%s", tx.result['result'])
   
     def join_meeting(self):
         self.logs.debug('Join Meeting clicked')
         # Check which meeting software should be launched, and if setup is required, before launching
-        x = utilities.env.load(self.global_env, 'MEETING_SOFTWARE')
+        x = utilities.Settings.load(self.global_env, 'DEFAULT', 'MEETING_SOFTWARE')
         match x['result']:
             case 'jitsi':
-                self.logs.debug(f"Selected Jitsi Meeting.")
-                y = utilities.env.load(self.jitsi_env, 'JITSI_SETUP_REQUIRED')
+                self.logs.debug("Selected Jitsi Meeting.")
+                y = utilities.Settings.load(self.jitsi_env, 'DEFAULT', 'JITSI_SETUP_REQUIRED')
                 # If Jitsi setup is not required, attempt to start.
                 if y['result'] != 'Yes':
-                    try:
-                        self.logs.debug("Trying to launch Jitsi meeting...")
-                        with sync_playwright() as playwright:
-                            jitsi.run(playwright)
-                    except Exception as e:
-                        self.logs.error(f"Couldn't launch Jitsi: {e}")
+                    self.logs.debug("Trying to launch Jitsi meeting...")
+                    self.sidebar_button_1.configure(text="Leave Meeting", command=self.leave_meeting)
+                    self.pause_preview()
+                    self.ensure_meeting().start_meeting()
                 else:
                     self.logs.error("Jitsi requires setup in settings.")
             case default:
-                self.logs.error(f"There was an error trying to determine meeting software. Are you trying to launch: {x['value']}?")
+                self.logs.error("There was an error trying to determine meeting software. Are you trying to launch: %s?", x['result'])
                 self.logs.critical("You need to set up meeting software settings!")
 
+    def leave_meeting(self):
+        self.logs.debug('Leave Meeting clicked')
+        self.sidebar_status.configure(text="Leaving...")
+        if self.meeting is not None:
+            self.meeting.leave_meeting()
+
+    def poll_meeting_events(self):
+        # Drain state changes from the meeting worker without blocking the UI
+        try:
+            while True:
+                state, detail = self.meeting_events.get_nowait()
+                # Live stream health readout, sent every few seconds while in a meeting
+                if state == 'stats':
+                    self.sidebar_stats.configure(text=detail)
+                    continue
+                self.sidebar_status.configure(text=state.capitalize())
+                if state in ('failed', 'left'):
+                    if detail:
+                        self.logs.error("Meeting %s: %s", state, detail)
+                    self.sidebar_button_1.configure(text="Join Meeting", command=self.join_meeting)
+                    self.sidebar_stats.configure(text="")
+                    self.resume_preview()
+        except queue.Empty:
+            pass
+        self.after(100, self.poll_meeting_events)
+
+    def on_close(self):
+        # Hide the window at once, the worker threads are given time to clean up below
+        self.withdraw()
+        if self.preview is not None:
+            self.preview.stop()
+        if self.metrics is not None:
+            self.metrics.stop()
+        if self.meeting is not None:
+            self.meeting.shutdown()
+            self.meeting.join(self.SHUTDOWN_TIMEOUT)
+            if self.meeting.is_alive():
+                self.logs.error("Meeting worker didn't finish within %ss, exiting anyway.", self.SHUTDOWN_TIMEOUT)
+        if self.preview is not None:
+            self.preview.join(2.0)
+        utilities.Settings.flush()
+        self.destroy()
+
 App().mainloop()
\ No newline at end of file
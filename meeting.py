@@ -0,0 +1,242 @@
+"""Run the meeting browser session off the Tk main loop."""
+import time
+import queue
+import threading
+from pathlib import Path
+import utilities
+import defaults
+import jitsi
+import browser_profile
+from browser_pool import BrowserPool
+from supervisor import SessionSupervisor
+from playwright.sync_api import sync_playwright
+
+
+class MeetingWorker(threading.Thread):
+    """
+    Own the Playwright session in a background thread.
+
+    Playwright's sync API is bound to the thread that started it, so every browser call
+    happens here. The UI sends commands through the methods below, and receives
+    (state, detail) tuples on the `events` queue, which it polls with `after()`.
+    """
+
+    # How often the idle loop wakes up to expire a parked browser, in seconds
+    POLL_INTERVAL = 5.0
+
+    # Directory the last meeting's WebRTC stats rings are kept in, read them with stats.StatsRing.read()
+    STATS_DIR = str(Path('Logs'))
+
+    def __init__(self, events: queue.Queue, *args, **kwargs):
+        """
+        Args:
+            events: Thread-safe queue the worker reports its state changes on.
+        """
+        super().__init__(*args, name='MeetingWorker', daemon=True, **kwargs)
+        self.events = events
+        self.commands = queue.Queue()
+        self.leave = threading.Event()
+        self.stopping = threading.Event()
+        self.logs = utilities.Logs(app_name='Meeting')
+        self.global_env = str(Path('Settings/global.env'))
+        self._playwright = None
+        self._pool = None
+        self._join_started = 0.0
+        self._warm = False
+        self._netstats = None
+        self._supervisor = None
+        self._board = None
+        self._failed = False
+
+    def start_meeting(self) -> None:
+        """ Ask the worker to join the meeting. """
+        self.leave.clear()
+        self.commands.put('join')
+
+    def leave_meeting(self) -> None:
+        """ Ask the worker to leave the current meeting. """
+        self.leave.set()
+
+    def shutdown(self) -> None:
+        """ Leave any meeting and stop the worker. """
+        self.stopping.set()
+        self.leave.set()
+        self.commands.put('stop')
+
+    def report(self, state: str, detail: str = '') -> None:
+        """ Pass a state change from the session back to the UI. """
+        if state == 'failed':
+            self._failed = True
+        self.logs.debug("Meeting state: %s %s", state, detail.rstrip())
+        self.events.put((state, detail))
+
+    def load_options(self) -> dict:
+        """ Read the browser options from global.env, with defaults for older files. """
+        options = dict(defaults.BROWSER_OPTIONS)
+        x = utilities.Settings.get_many(self.global_env, options)
+        if x['success']:
+            options.update(x['result'])
+        try:
+            idle_timeout = float(options['BROWSER_IDLE_TIMEOUT'])
+        except ValueError:
+            self.logs.error("Invalid BROWSER_IDLE_TIMEOUT: %s", options['BROWSER_IDLE_TIMEOUT'])
+            idle_timeout = 600.0
+        try:
+            profile_max = int(float(options['BROWSER_PROFILE_MAX_MB']) * 1024 * 1024)
+        except ValueError:
+            self.logs.error("Invalid BROWSER_PROFILE_MAX_MB: %s", options['BROWSER_PROFILE_MAX_MB'])
+            profile_max = 300 * 1024 * 1024
+        return {
+            'warm': options['BROWSER_WARM'] == 'Yes',
+            'idle_timeout': idle_timeout,
+            'profile_dir': options['BROWSER_PROFILE_DIR'] if options['BROWSER_PROFILE'] == 'Yes' else None,
+            'profile_max': profile_max
+        }
+
+    def launch(self) -> tuple:
+        """ Launch a browser for the pool, pruning the persistent profile first if one is used. """
+        options = self.load_options()
+        profile_dir = options['profile_dir']
+        if profile_dir:
+            x = browser_profile.prune(profile_dir, options['profile_max'])
+            if not x['success']:
+                self.logs.error("Couldn't prune browser profile: %s", x['result'])
+            elif x['result']:
+                self.logs.info("Pruned %.1f MiB from browser profile cache", x['result'] / 1024 / 1024)
+        return jitsi.launch(self._playwright, profile_dir)
+
+    def pool(self) -> BrowserPool:
+        """ Start Playwright and the browser pool on first use. """
+        if self._pool is None:
+            self._playwright = sync_playwright().start()
+            self._pool = BrowserPool(self.launch)
+        self._pool.idle_timeout = self.load_options()['idle_timeout']
+        return self._pool
+
+    def run(self) -> None:
+        if self.load_options()['warm']:
+            self.pool().warm()
+        try:
+            while True:
+                try:
+                    command = self.commands.get(timeout=self.POLL_INTERVAL)
+                except queue.Empty:
+                    if self._pool is not None:
+                        self._pool.expire_if_idle()
+                    continue
+                if command == 'stop':
+                    break
+                if command == 'join':
+                    # A leave pressed before the join was picked up cancels it
+                    if self.leave.is_set():
+                        self.report('left')
+                        continue
+                    try:
+                        self.join()
+                        if self.load_options()['warm'] and not self.stopping.is_set():
+                            self.pool().warm()
+                    except Exception as e:
+                        # Keep the worker alive, so the next Join is still picked up
+                        self.logs.error("Meeting worker error: %s", e)
+                        self.report('failed', str(e))
+        finally:
+            if self._pool is not None:
+                self._pool.close()
+            if self._playwright is not None:
+                self._playwright.stop()
+
+    def join(self) -> None:
+        """ Run one meeting, with every configured camera session, from a pooled browser until it is left or fails. """
+        self._join_started = time.monotonic()
+        self._failed = False
+        lease = None
+        try:
+            pool = self.pool()
+            if not pool.is_warm:
+                self.report('launching')
+            lease = pool.acquire()
+            self._warm = lease.warm
+            self._netstats = browser_profile.NetworkStats(lease.page)
+            self.start_board()
+            self._supervisor = SessionSupervisor(lease, self.report, self.STATS_DIR, self.leave, self.relaunch)
+            sessions = jitsi.load_sessions(self.logs)
+            if self._board is not None:
+                import board
+                board.use_output(sessions)
+            if not self._supervisor.start(sessions):
+                if self.leave.is_set():
+                    self.logs.info("Left before joining.")
+                    return
+                errors = [session.error for session in self._supervisor.sessions if session.error]
+                self.report('failed', '\n'.join(errors) or 'No session could join.')
+                return
+            self.on_joined()
+            # Waiting through the page keeps Playwright's events flowing for every session
+            while not self.leave.is_set():
+                self._supervisor.wait(500)
+                self.tick()
+            self.logs.info("Left meeting.")
+        except Exception as e:
+            self.logs.error("Couldn't launch Jitsi: %s", e)
+            self.report('failed', str(e))
+        finally:
+            if self._supervisor is not None:
+                lease = self._supervisor.lease
+                try:
+                    self._supervisor.close()
+                except Exception as e:
+                    self.logs.error("Couldn't close the meeting's sessions: %s", e)
+                self._supervisor = None
+            if self._netstats is not None:
+                self._netstats.detach()
+                self._netstats = None
+            if lease is not None:
+                self._pool.release(lease)
+            if self._board is not None:
+                import board
+                board.stop(self._board, self.logs)
+                self._board = None
+            # A failure is the meeting's last state, so the UI keeps showing why
+            if not self._failed:
+                self.report('left')
+
+    def start_board(self) -> None:
+        """
+        Start the board pipeline process for this meeting, if BOARD_PIPELINE is on. Blocks until
+        its first frame is on the loopback camera, so sessions can pin it. If it doesn't come up,
+        the meeting goes ahead with the board camera as it is.
+        """
+        settings = jitsi.load_settings(self.logs)
+        if settings['BOARD_PIPELINE'] != 'Yes':
+            return
+        # Only needs NumPy and OpenCV when it's used
+        import board
+        try:
+            self._board = board.start(settings, self.logs)
+        except OSError as e:
+            self.logs.error("Couldn't start the board pipeline: %s", e)
+        if self._board is None:
+            self.logs.error("Joining without the board pipeline, %s is sent unprocessed.", settings['BOARD_SOURCE'])
+
+    def relaunch(self, lease):
+        """ Swap a lease whose browser died for a freshly launched one, for the supervisor to rejoin in. """
+        if self._netstats is not None:
+            self._netstats.detach()
+            self._netstats = None
+        self._pool.release(lease)
+        return self._pool.acquire()
+
+    def on_joined(self) -> None:
+        """ Report the meeting as joined, logging time-to-join. """
+        elapsed = time.monotonic() - self._join_started
+        start = 'warm' if self._warm else 'cold'
+        self.logs.info("Time to join: %.2fs (%s start)", elapsed, start)
+        if self._netstats is not None:
+            self.logs.info(self._netstats.summary())
+        self.report('joined')
+
+    def tick(self) -> None:
+        """ Periodic in-meeting work, run on this thread between Playwright waits. """
+        summary = self._supervisor.tick()
+        if summary is not None:
+            self.events.put(('stats', summary))
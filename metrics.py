@@ -0,0 +1,335 @@
+"""Sample what the bot costs the Pi, from /proc and /sys, and serve it in Prometheus text format."""
+import os
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import utilities
+import defaults
+from quality import SystemLoad
+
+# global.env keys for metrics, and their defaults for files written before they existed
+OPTIONS = defaults.METRICS_OPTIONS
+
+# Bits of the firmware's get_throttled value
+THROTTLED_FLAGS = {
+    0: 'under_voltage',
+    1: 'arm_frequency_capped',
+    2: 'throttled',
+    3: 'soft_temperature_limit',
+    16: 'under_voltage_occurred',
+    17: 'arm_frequency_capped_occurred',
+    18: 'throttled_occurred',
+    19: 'soft_temperature_limit_occurred'
+}
+THROTTLED_PATH = '/sys/devices/platform/soc/soc:firmware/get_throttled'
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def load_options(file: str, logs) -> dict:
+    """
+    Read the metrics options from global.env.
+
+    Returns:
+        dict: 'enabled', 'port', 'interval', 'log_interval' and 'disk'.
+    """
+    options = dict(OPTIONS)
+    x = utilities.Settings.get_many(file, options)
+    if x['success']:
+        options.update(x['result'])
+    parsed = {}
+    for key, name, cast in (('METRICS_PORT', 'port', int), ('METRICS_INTERVAL', 'interval', float),
+                            ('METRICS_LOG_INTERVAL', 'log_interval', float)):
+        try:
+            parsed[name] = cast(options[key])
+        except ValueError:
+            logs.error("Invalid %s: %s", key, options[key])
+            parsed[name] = cast(OPTIONS[key])
+    parsed['enabled'] = options['METRICS'] == 'Yes'
+    parsed['disk'] = options['METRICS_DISK']
+    return parsed
+
+
+def read_stat(pid: int) -> tuple:
+    """
+    Parent pid, CPU ticks (user + system) and RSS bytes of a process, from /proc/<pid>/stat.
+
+    Returns:
+        tuple: (ppid, ticks, rss), or None if the process is gone.
+    """
+    try:
+        with open(f'/proc/{pid}/stat', 'rb') as f:
+            # Fields after the ')' that closes the command name, which may contain spaces
+            fields = f.read().rsplit(b')', 1)[1].split()
+    except (OSError, IOError):
+        return None
+    return int(fields[1]), int(fields[11]) + int(fields[12]), int(fields[21]) * PAGE_SIZE
+
+
+def process_role(pid: int) -> str:
+    """ What a process in the bot's tree is: 'app', 'playwright', 'board', or Chromium's 'browser', 'renderer', 'gpu'... """
+    if pid == os.getpid():
+        return 'app'
+    try:
+        with open(f'/proc/{pid}/cmdline', 'rb') as f:
+            args = f.read().split(b'\0')
+    except (OSError, IOError):
+        return 'other'
+    command = os.path.basename(args[0]).decode('utf-8', 'replace')
+    if 'chrom' in command or 'headless_shell' in command:
+        for arg in args:
+            if arg.startswith(b'--type='):
+                return arg[7:].decode('utf-8', 'replace').replace('-', '_')
+        return 'browser'
+    if command.startswith('node'):
+        return 'playwright'
+    if any(arg.endswith(b'board.py') for arg in args):
+        return 'board'
+    return 'other'
+
+
+class ProcessTree:
+    """
+    CPU and memory of this process and everything it started (Playwright, Chromium, the board pipeline).
+
+    Each sample walks /proc for parent pids, then reads one stat file per process in the tree.
+    A process's role is read from its command line once, when it's first seen.
+    """
+
+    def __init__(self, root: int = None):
+        self.root = root or os.getpid()
+        self._roles = {}
+        self._last = {}
+        self._last_time = None
+
+    def descendants(self) -> dict:
+        """ {pid: (ticks, rss)} for the root and all its descendants. """
+        children = {}
+        stats = {}
+        for name in os.listdir('/proc'):
+            if not name.isdigit():
+                continue
+            stat = read_stat(int(name))
+            if stat is not None:
+                children.setdefault(stat[0], []).append(int(name))
+                stats[int(name)] = stat[1:]
+        tree = {}
+        pending = [self.root]
+        while pending:
+            pid = pending.pop()
+            if pid in stats:
+                tree[pid] = stats[pid]
+                pending.extend(children.get(pid, ()))
+        return tree
+
+    def sample(self) -> dict:
+        """
+        Returns:
+            dict: {role: {'processes', 'cpu_percent', 'rss_bytes'}}. CPU is percent of one core,
+            since the previous sample (0 on the first).
+        """
+        now = time.monotonic()
+        tree = self.descendants()
+        elapsed = now - self._last_time if self._last_time is not None else 0.0
+        roles = {}
+        for pid, (ticks, rss) in tree.items():
+            if pid not in self._roles:
+                self._roles[pid] = process_role(pid)
+            role = roles.setdefault(self._roles[pid], {'processes': 0, 'cpu_percent': 0.0, 'rss_bytes': 0})
+            role['processes'] += 1
+            role['rss_bytes'] += rss
+            if elapsed and pid in self._last:
+                role['cpu_percent'] += (ticks - self._last[pid]) / CLOCK_TICKS / elapsed * 100
+        self._last = {pid: ticks for pid, (ticks, _rss) in tree.items()}
+        self._roles = {pid: role for pid, role in self._roles.items() if pid in tree}
+        self._last_time = now
+        return roles
+
+
+class DiskWrites:
+    """Bytes written to a block device, from /sys/block/<disk>/stat."""
+
+    def __init__(self, disk: str = 'mmcblk0'):
+        self.disk = disk
+        self.path = f'/sys/block/{disk}/stat'
+        self._last = None
+
+    def sample(self) -> tuple:
+        """
+        Returns:
+            tuple: (total bytes written, bytes per second since the last sample), or None if unreadable.
+        """
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                # The 7th field is sectors written, always in 512 byte units
+                written = int(f.read().split()[6]) * 512
+        except (OSError, IOError, ValueError, IndexError):
+            return None
+        now = time.monotonic()
+        last, self._last = self._last, (now, written)
+        rate = (written - last[1]) / (now - last[0]) if last is not None and now > last[0] else 0.0
+        return written, rate
+
+
+def throttled(path: str = THROTTLED_PATH) -> dict:
+    """
+    The firmware's throttling flags.
+
+    Returns:
+        dict: {flag name: bool}, empty if the firmware doesn't expose them (not a Pi, or an old kernel).
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            value = int(f.read().strip(), 16)
+    except (OSError, IOError, ValueError):
+        return {}
+    return {name: bool(value & (1 << bit)) for bit, name in THROTTLED_FLAGS.items()}
+
+
+class MetricsCollector(threading.Thread):
+    """
+    Sample the bot's resource use every `interval` seconds on a background thread.
+
+    The newest sample is rendered to Prometheus text once, and served as is from a local HTTP
+    endpoint, so scraping costs no extra sampling. A one line summary is logged every
+    `log_interval` seconds. The collector times itself, and reports its own cost as metrics.
+    """
+
+    def __init__(self, port: int = 9101, interval: float = 10.0, log_interval: float = 300.0,
+                 disk: str = 'mmcblk0', host: str = '127.0.0.1'):
+        """
+        Args:
+            port: Port for the /metrics endpoint, 0 for none.
+            interval: Seconds between samples.
+            log_interval: Seconds between summaries in the log.
+            disk: Block device the SD card is, under /sys/block.
+            host: Address to listen on; local only by default.
+        """
+        super().__init__(name='Metrics', daemon=True)
+        self.interval = interval
+        self.log_interval = log_interval
+        self.logs = utilities.Logs(app_name='Metrics')
+        self.tree = ProcessTree()
+        self.disk = DiskWrites(disk)
+        self.load = SystemLoad()
+        self.text = b''
+        self.samples = 0
+        self.sample_seconds = 0.0
+        self.sample_cpu_seconds = 0.0
+        self.last_sample_seconds = 0.0
+        self._stopping = threading.Event()
+        self._server = None
+        if port:
+            collector = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path != '/metrics':
+                        self.send_error(404)
+                        return
+                    body = collector.text
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    pass
+
+            try:
+                self._server = ThreadingHTTPServer((host, port), Handler)
+            except OSError as e:
+                self.logs.error("Couldn't serve metrics on %s:%s: %s", host, port, e)
+
+    def run(self) -> None:
+        if self._server is not None:
+            threading.Thread(target=self._server.serve_forever, name='MetricsHTTP', daemon=True).start()
+            self.logs.info("Serving metrics on http://%s:%s/metrics", *self._server.server_address[:2])
+        last_log = time.monotonic()
+        while not self._stopping.wait(self.interval if self.samples else 0):
+            sample = self.sample()
+            if time.monotonic() - last_log >= self.log_interval:
+                self.logs.info(self.summary(sample))
+                last_log = time.monotonic()
+
+    def stop(self) -> None:
+        """ Stop sampling and serving. """
+        self._stopping.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def sample(self) -> dict:
+        """ Take one sample, and render it for the endpoint. """
+        started, cpu_started = time.perf_counter(), time.thread_time()
+        sample = {
+            'roles': self.tree.sample(),
+            'system_cpu_percent': self.load.cpu_percent(),
+            'temperature': self.load.temperature(),
+            'throttled': throttled(),
+            'disk': self.disk.sample()
+        }
+        self.last_sample_seconds = time.perf_counter() - started
+        self.sample_seconds += self.last_sample_seconds
+        self.sample_cpu_seconds += time.thread_time() - cpu_started
+        self.samples += 1
+        self.text = self.render(sample).encode('utf-8')
+        return sample
+
+    def render(self, sample: dict) -> str:
+        """ A sample in Prometheus text format. """
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str, values: list) -> None:
+            lines.append(f"# HELP streambot_{name} {help_text}")
+            lines.append(f"# TYPE streambot_{name} {kind}")
+            for labels, value in values:
+                label_text = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                # repr() keeps a float's full precision; counters like bytes written stay exact as ints
+                value = repr(round(value, 6)) if isinstance(value, float) else str(value)
+                lines.append(f"streambot_{name}{{{label_text}}} {value}" if label_text else f"streambot_{name} {value}")
+
+        roles = sorted(sample['roles'].items())
+        metric('process_cpu_percent', 'gauge', 'CPU use of the bot and its child processes, percent of one core.',
+               [({'role': role}, values['cpu_percent']) for role, values in roles])
+        metric('process_rss_bytes', 'gauge', 'Resident memory of the bot and its child processes.',
+               [({'role': role}, values['rss_bytes']) for role, values in roles])
+        metric('processes', 'gauge', 'Number of processes in each role.',
+               [({'role': role}, values['processes']) for role, values in roles])
+        if sample['system_cpu_percent'] is not None:
+            metric('system_cpu_percent', 'gauge', 'CPU use of the whole Pi, percent of all cores.',
+                   [({}, sample['system_cpu_percent'])])
+        if sample['temperature'] is not None:
+            metric('soc_temperature_celsius', 'gauge', 'SoC temperature.', [({}, sample['temperature'])])
+        if sample['throttled']:
+            metric('throttled', 'gauge', 'Firmware throttling flags, 1 if set.',
+                   [({'flag': flag}, int(value)) for flag, value in sample['throttled'].items()])
+        if sample['disk'] is not None:
+            metric('disk_written_bytes_total', 'counter', 'Bytes written to the SD card since boot.',
+                   [({'device': self.disk.disk}, sample['disk'][0])])
+            metric('disk_write_bytes_per_second', 'gauge', 'SD card write rate over the last interval.',
+                   [({'device': self.disk.disk}, sample['disk'][1])])
+        metric('metrics_samples_total', 'counter', 'Samples taken by the collector.', [({}, self.samples)])
+        metric('metrics_sample_seconds_total', 'counter', 'Wall time spent sampling.', [({}, self.sample_seconds)])
+        metric('metrics_sample_cpu_seconds_total', 'counter', 'CPU time spent sampling.',
+               [({}, self.sample_cpu_seconds)])
+        metric('metrics_last_sample_seconds', 'gauge', 'Wall time the last sample took.',
+               [({}, self.last_sample_seconds)])
+        return '\n'.join(lines) + '\n'
+
+    def summary(self, sample: dict) -> str:
+        """ One line summary of a sample for the log. """
+        roles = ', '.join(f"{role} {values['cpu_percent']:.0f}% {values['rss_bytes'] / 1024 / 1024:.0f} MiB"
+                          for role, values in sorted(sample['roles'].items()))
+        text = f"Resources: {roles}"
+        if sample['temperature'] is not None:
+            text += f"; SoC {sample['temperature']:.1f}C"
+        flags = [flag for flag, value in sample['throttled'].items() if value and not flag.endswith('occurred')]
+        if flags:
+            text += f"; {', '.join(flags)}"
+        if sample['disk'] is not None:
+            text += f"; SD writes {sample['disk'][1] / 1024:.0f} KiB/s"
+        text += f"; sampling {self.last_sample_seconds * 1000:.1f} ms"
+        return text
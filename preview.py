@@ -0,0 +1,252 @@
+"""Live camera preview for the main window, captured and scaled off the Tk thread."""
+import time
+import threading
+import numpy as np
+import cv2
+import utilities
+import defaults
+
+# Capture size asked of the camera. Enough for the panel, and cheap to read and scale on the Pi.
+CAPTURE_SIZE = (640, 480)
+
+# global.env keys for the preview, and their defaults for files written before they existed
+OPTIONS = defaults.PREVIEW_OPTIONS
+
+
+def load_options(file: str, logs) -> dict:
+    """
+    Read the preview options from global.env.
+
+    Args:
+        file: Path to global.env.
+        logs: Logger to report invalid values to.
+
+    Returns:
+        dict: 'enabled', 'device', 'fps' and 'cpu_percent'.
+    """
+    options = dict(OPTIONS)
+    x = utilities.Settings.get_many(file, options)
+    if x['success']:
+        options.update(x['result'])
+    try:
+        fps = max(float(options['PREVIEW_FPS']), 1.0)
+    except ValueError:
+        logs.error("Invalid PREVIEW_FPS: %s", options['PREVIEW_FPS'])
+        fps = float(OPTIONS['PREVIEW_FPS'])
+    try:
+        cpu_percent = min(max(float(options['PREVIEW_CPU_PERCENT']), 1.0), 100.0)
+    except ValueError:
+        logs.error("Invalid PREVIEW_CPU_PERCENT: %s", options['PREVIEW_CPU_PERCENT'])
+        cpu_percent = float(OPTIONS['PREVIEW_CPU_PERCENT'])
+    return {
+        'enabled': options['PREVIEW'] == 'Yes',
+        'device': options['PREVIEW_DEVICE'],
+        'fps': fps,
+        'cpu_percent': cpu_percent
+    }
+
+
+class FrameSlot:
+    """
+    Hold only the newest frame.
+
+    A frame put before the last one was taken replaces it, so the display never works through
+    a backlog and always shows what the camera sees now. Thread-safe.
+    """
+
+    def __init__(self):
+        self.frames = 0
+        self.dropped = 0
+        self._frame = None
+        self._lock = threading.Lock()
+
+    def put(self, frame) -> None:
+        """ Store a frame, dropping the one still waiting, if any. """
+        with self._lock:
+            if self._frame is not None:
+                self.dropped += 1
+            self._frame = frame
+            self.frames += 1
+
+    def take(self):
+        """ The newest frame, or None if there's been no new one since the last take. """
+        with self._lock:
+            frame, self._frame = self._frame, None
+        return frame
+
+
+class Downscaler:
+    """
+    Shrink BGR frames to fit a panel, as binary PPM that Tk's PhotoImage reads directly.
+
+    Frames are decimated by a whole-number stride, which is cheap enough to run at camera rate
+    on the Pi. The stride, flip to RGB and copy happen in one NumPy copy into a PPM buffer that
+    is reused from frame to frame; the only other copy is the bytes object handed to Tk.
+    """
+
+    def __init__(self, max_width: int, max_height: int):
+        """
+        Args:
+            max_width, max_height: Size of the panel, in pixels.
+        """
+        self.max_width = max_width
+        self.max_height = max_height
+        self._shape = None
+        self._stride = 1
+        self._buffer = None
+        self._pixels = None
+
+    def resize(self, max_width: int, max_height: int) -> None:
+        """ Fit later frames to a new panel size. """
+        if (max_width, max_height) != (self.max_width, self.max_height):
+            self.max_width, self.max_height = max(max_width, 1), max(max_height, 1)
+            self._shape = None
+
+    def __call__(self, frame: np.ndarray) -> bytes:
+        """
+        Args:
+            frame: A height x width x 3 BGR frame, as from OpenCV.
+
+        Returns:
+            bytes: The scaled frame as binary PPM.
+        """
+        if frame.shape != self._shape:
+            self._setup(frame.shape)
+        height, width = self._pixels.shape[:2]
+        np.copyto(self._pixels, frame[:height * self._stride:self._stride, :width * self._stride:self._stride, ::-1])
+        return bytes(self._buffer)
+
+    def _setup(self, shape: tuple) -> None:
+        height, width = shape[:2]
+        self._stride = max(1, -(-width // self.max_width), -(-height // self.max_height))
+        out_width, out_height = width // self._stride, height // self._stride
+        header = f"P6 {out_width} {out_height} 255\n".encode('ascii')
+        self._buffer = bytearray(len(header) + out_width * out_height * 3)
+        self._buffer[:len(header)] = header
+        self._pixels = np.frombuffer(self._buffer, dtype=np.uint8, offset=len(header)).reshape(out_height, out_width, 3)
+        self._shape = shape
+
+
+class CameraPreview(threading.Thread):
+    """
+    Read frames from the camera on a background thread, scale them, and leave the newest in a FrameSlot.
+
+    The thread holds the camera only while resumed: pause() releases the device, so Chromium can
+    open it for a meeting. It sleeps between frames to keep to `fps`, and long enough that its own
+    CPU time stays under `cpu_percent` of one core, so it never competes with the encoder.
+    """
+
+    # Seconds to wait before retrying a camera that won't open, doubled after each further failure
+    RETRY_START = 5.0
+    RETRY_MAX = 60.0
+
+    def __init__(self, device: str, slot: FrameSlot, downscaler: Downscaler, fps: float = 10.0,
+                 cpu_percent: float = 25.0):
+        """
+        Args:
+            device: Camera device (e.g. /dev/video0), or a video file.
+            slot: Where scaled frames are left for the UI.
+            downscaler: Turns camera frames into PPM for the panel.
+            fps: Most frames per second to capture.
+            cpu_percent: Most CPU time this thread may use, in percent of one core.
+        """
+        super().__init__(name='CameraPreview', daemon=True)
+        self.device = device
+        self.slot = slot
+        self.downscaler = downscaler
+        self.interval = 1.0 / fps
+        self.cpu_percent = cpu_percent
+        self.released = threading.Event()
+        self.released.set()
+        self.logs = utilities.Logs(app_name='Preview')
+        self._running = threading.Event()
+        self._stopping = threading.Event()
+        self._open_failures = 0
+
+    def resume(self) -> None:
+        """ Open the camera and start capturing. """
+        self._running.set()
+
+    def pause(self, timeout: float = 1.0) -> bool:
+        """
+        Stop capturing and release the camera.
+
+        Args:
+            timeout: Seconds to wait for the camera to be released.
+
+        Returns:
+            bool: True if the camera is released.
+        """
+        self._running.clear()
+        return self.released.wait(timeout)
+
+    def stop(self) -> None:
+        """ Release the camera and end the thread. """
+        self._stopping.set()
+        self._running.set()
+
+    def run(self) -> None:
+        capture = None
+        try:
+            while not self._stopping.is_set():
+                if not self._running.is_set():
+                    if capture is not None:
+                        capture = self.close(capture)
+                    self.released.set()
+                    self._running.wait()
+                    continue
+                if capture is None:
+                    self.released.clear()
+                    # A pause between the wait above and here must not open the camera
+                    if not self._running.is_set():
+                        continue
+                    capture = self.open()
+                    if capture is None:
+                        self._stopping.wait(min(self.RETRY_START * 2 ** (self._open_failures - 1), self.RETRY_MAX))
+                        continue
+
+                started = time.monotonic()
+                cpu_started = time.thread_time()
+                ok, frame = capture.read()
+                if not ok:
+                    self.logs.error("Couldn't read a frame from %s, reopening it.", self.device)
+                    capture = self.close(capture)
+                    self._stopping.wait(1.0)
+                    continue
+                self.slot.put(self.downscaler(frame))
+                busy = time.thread_time() - cpu_started
+                elapsed = time.monotonic() - started
+                self._stopping.wait(max(self.interval - elapsed, busy * (100.0 / self.cpu_percent - 1.0)))
+        finally:
+            if capture is not None:
+                self.close(capture)
+            self.released.set()
+
+    def open(self):
+        """
+        Open the camera at CAPTURE_SIZE, or return None if it can't be opened. Only the first
+        failure in a row is an error, errors are flushed to the SD card straight away.
+        """
+        capture = cv2.VideoCapture(self.device)
+        if not capture.isOpened():
+            if self._open_failures == 0:
+                self.logs.error("Couldn't open camera %s for the preview, retrying in the background.", self.device)
+            else:
+                self.logs.debug("Still can't open camera %s (%s attempts)", self.device, self._open_failures + 1)
+            self._open_failures += 1
+            capture.release()
+            return None
+        self._open_failures = 0
+        capture.set(cv2.CAP_PROP_FRAME_WIDTH, CAPTURE_SIZE[0])
+        capture.set(cv2.CAP_PROP_FRAME_HEIGHT, CAPTURE_SIZE[1])
+        # Keep the driver from queueing frames, so the one read is the newest
+        capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.logs.info("Preview started on %s", self.device)
+        return capture
+
+    def close(self, capture) -> None:
+        """ Release the camera. Returns None, for `capture = self.close(capture)`. """
+        capture.release()
+        self.logs.info("Preview released %s (%s frames, %s dropped before display)",
+                       self.device, self.slot.frames, self.slot.dropped)
+        return None
@@ -0,0 +1,154 @@
+"""Step the sent video quality down and back up with the Pi's CPU load and SoC temperature."""
+import time
+import utilities
+
+# Sent frame heights the controller steps between, highest first
+LEVELS = (720, 540, 360, 180)
+
+# Tell Jitsi the highest frame height to send. Both the redux preference (what the
+# "Manage video quality" slider sets) and the sender constraint on the room are updated.
+APPLY_JS = """
+(height) => {
+    const app = window.APP;
+    if (!app) return false;
+    if (app.store) app.store.dispatch({type: 'SET_PREFERRED_VIDEO_QUALITY', preferredVideoQuality: height});
+    const room = app.conference && app.conference._room;
+    if (room && room.setSenderVideoConstraint) room.setSenderVideoConstraint(height);
+    return true;
+}
+"""
+
+
+class SystemLoad:
+    """Read CPU load and SoC temperature from /proc and /sys. Paths can be overridden for testing."""
+
+    def __init__(self, stat_path: str = '/proc/stat',
+                 thermal_path: str = '/sys/class/thermal/thermal_zone0/temp'):
+        """
+        Args:
+            stat_path: File with the kernel's cpu time counters.
+            thermal_path: File with the SoC temperature in millidegrees Celsius.
+        """
+        self.stat_path = stat_path
+        self.thermal_path = thermal_path
+        self._last = None
+
+    def cpu_percent(self) -> float:
+        """
+        CPU busy percentage since the previous call (0.0 on the first call).
+
+        Returns:
+            float: Percent of all cores busy, or None if it couldn't be read.
+        """
+        try:
+            with open(self.stat_path, 'r', encoding='utf-8') as f:
+                fields = [int(x) for x in f.readline().split()[1:]]
+        except (OSError, IOError, ValueError):
+            return None
+        # user nice system idle iowait irq softirq steal ...
+        idle = fields[3] + (fields[4] if len(fields) > 4 else 0)
+        total = sum(fields)
+        last, self._last = self._last, (idle, total)
+        if last is None or total == last[1]:
+            return 0.0
+        return 100.0 * (1.0 - (idle - last[0]) / (total - last[1]))
+
+    def temperature(self) -> float:
+        """
+        SoC temperature.
+
+        Returns:
+            float: Degrees Celsius, or None if it couldn't be read.
+        """
+        try:
+            with open(self.thermal_path, 'r', encoding='utf-8') as f:
+                return int(f.read().strip()) / 1000.0
+        except (OSError, IOError, ValueError):
+            return None
+
+
+class QualityController:
+    """
+    Pick a sent video height from CPU load and temperature, with hysteresis.
+
+    Quality steps down one level as soon as either reading is above its high mark, and only
+    steps back up once both are below their low marks and `hold` seconds have passed since the
+    last change, so it doesn't flap around a threshold.
+    """
+
+    def __init__(self, max_height: int = 720, load: SystemLoad = None, interval: float = 5.0,
+                 hold: float = 60.0, cpu_high: float = 85.0, cpu_low: float = 60.0,
+                 temp_high: float = 75.0, temp_low: float = 68.0):
+        """
+        Args:
+            max_height: Highest height to send, normally the capture height.
+            load: Where readings come from, defaults to the real /proc and /sys files.
+            interval: Seconds between samples.
+            hold: Seconds to wait after a change before stepping back up.
+            cpu_high, cpu_low: CPU percent to step down above, and allow stepping up below.
+            temp_high, temp_low: Degrees Celsius to step down above, and allow stepping up below.
+        """
+        self.levels = [h for h in LEVELS if h < max_height]
+        self.levels.insert(0, max_height)
+        self.load = load or SystemLoad()
+        self.interval = interval
+        self.hold = hold
+        self.cpu_high, self.cpu_low = cpu_high, cpu_low
+        self.temp_high, self.temp_low = temp_high, temp_low
+        self.index = 0
+        self.logs = utilities.Logs(app_name='Quality')
+        self._last_sample = 0.0
+        self._last_change = 0.0
+        # Prime the CPU counters so the first real sample covers a whole interval
+        self.load.cpu_percent()
+
+    @property
+    def height(self) -> int:
+        """ The height currently asked for. """
+        return self.levels[self.index]
+
+    def update(self, cpu: float, temp: float, now: float = None) -> int:
+        """
+        Feed one reading to the controller.
+
+        Args:
+            cpu: CPU percent, or None if unknown.
+            temp: Temperature in Celsius, or None if unknown.
+            now: Monotonic time of the reading, defaults to now.
+
+        Returns:
+            int: The new height if it changed, otherwise None.
+        """
+        now = time.monotonic() if now is None else now
+        cpu = cpu if cpu is not None else 0.0
+        temp = temp if temp is not None else 0.0
+        hot = cpu > self.cpu_high or temp > self.temp_high
+        cool = cpu < self.cpu_low and temp < self.temp_low
+        if hot and self.index < len(self.levels) - 1:
+            self.index += 1
+        elif cool and self.index > 0 and now - self._last_change >= self.hold:
+            self.index -= 1
+        else:
+            return None
+        self._last_change = now
+        self.logs.info("CPU %.0f%%, %.1fC: sending %sp", cpu, temp, self.height)
+        return self.height
+
+    def tick(self, page) -> None:
+        """
+        Sample and, if the level changed, apply it to the page. Call often from the page's thread;
+        it only does work once per `interval`.
+
+        Args:
+            page: The meeting page.
+        """
+        now = time.monotonic()
+        if now - self._last_sample < self.interval:
+            return
+        self._last_sample = now
+        height = self.update(self.load.cpu_percent(), self.load.temperature(), now)
+        if height is not None:
+            try:
+                page.evaluate(APPLY_JS, height)
+            except Exception as e:
+                self.logs.error("Couldn't set video quality: %s", e)
@@ -0,0 +1,288 @@
+"""Record the meeting page's media to segmented WebM files, streamed out in small chunks."""
+import os
+import time
+import queue
+import base64
+import shutil
+import threading
+import utilities
+
+# Start recording the page's outgoing camera and microphone, plus everyone else's audio if
+# `incoming` is set. MediaRecorder hands over a chunk every `timesliceMs`, which is sent
+# straight to Python, so the page never holds more than a chunk or two. Every `segmentMs` the
+# recorder is restarted, so each segment file is a complete WebM that plays on its own.
+START_JS = """
+async (opts) => {
+    const state = window.__streambotRecorder = window.__streambotRecorder || {};
+    if (state.recorder) return true;
+    const pcs = (window.__streambotPCs || []).filter(pc => pc.connectionState !== 'closed');
+    const live = t => t && t.readyState === 'live';
+    const sent = pcs.flatMap(pc => pc.getSenders().map(s => s.track)).filter(live);
+    const video = sent.find(t => t.kind === 'video');
+    let audio = sent.filter(t => t.kind === 'audio');
+    if (opts.incoming) {
+        const received = pcs.flatMap(pc => pc.getReceivers().map(r => r.track)).filter(t => live(t) && t.kind === 'audio');
+        if (received.length) {
+            // Mix every voice into one track, MediaRecorder only records one audio track
+            state.audio = new AudioContext();
+            state.audio.resume();
+            const mix = state.audio.createMediaStreamDestination();
+            for (const t of audio.concat(received)) state.audio.createMediaStreamSource(new MediaStream([t])).connect(mix);
+            audio = mix.stream.getAudioTracks();
+        }
+    }
+    const tracks = (video ? [video] : []).concat(audio.slice(0, 1));
+    if (!tracks.length) return false;
+    const stream = new MediaStream(tracks);
+    const mimeType = ['video/webm;codecs=vp8,opus', 'video/webm'].find(t => MediaRecorder.isTypeSupported(t));
+    const toBase64 = blob => new Promise(resolve => {
+        const reader = new FileReader();
+        reader.onload = () => resolve(reader.result.slice(reader.result.indexOf(',') + 1));
+        reader.readAsDataURL(blob);
+    });
+    // One chain for every chunk, so they reach Python in order, even across segments
+    state.chain = Promise.resolve();
+    state.segment = 0;
+    const begin = () => {
+        const segment = ++state.segment;
+        const recorder = new MediaRecorder(stream, {mimeType, videoBitsPerSecond: opts.videoBitsPerSecond});
+        recorder.ondataavailable = e => {
+            if (!e.data.size) return;
+            state.chain = state.chain.then(async () => window.__streambotRecordChunk(segment, await toBase64(e.data)));
+        };
+        recorder.start(opts.timesliceMs);
+        state.recorder = recorder;
+    };
+    begin();
+    state.timer = setInterval(() => { state.recorder.stop(); begin(); }, opts.segmentMs);
+    return true;
+}
+"""
+
+# Stop recording. The last chunk is delivered after this returns.
+STOP_JS = """
+() => {
+    const state = window.__streambotRecorder;
+    if (!state || !state.recorder) return;
+    clearInterval(state.timer);
+    state.recorder.stop();
+    state.recorder = null;
+    if (state.audio) { state.audio.close(); state.audio = null; }
+}
+"""
+
+
+class SegmentWriter(threading.Thread):
+    """
+    Append recorded chunks to segment files on a background thread.
+
+    Chunks arrive on a bounded queue, so memory stays constant however long the recording runs;
+    if the SD card falls so far behind that the queue fills, chunks are dropped, not buffered.
+    Before each segment and every `check_bytes` written, free space is checked: below `min_free`,
+    the oldest recordings are deleted to make room (`on_full` 'rotate'), or recording stops ('stop').
+    """
+
+    def __init__(self, directory: str, min_free: int, on_full: str = 'rotate', max_chunks: int = 32,
+                 check_bytes: int = 8 * 1024 * 1024):
+        """
+        Args:
+            directory: Where segment files are written.
+            min_free: Bytes of free disk space to keep.
+            on_full: 'rotate' to delete the oldest segments when space runs low, 'stop' to stop recording.
+            max_chunks: Chunks the queue holds before dropping.
+            check_bytes: Bytes written between free space checks.
+        """
+        super().__init__(name='SegmentWriter', daemon=True)
+        self.directory = directory
+        self.min_free = min_free
+        self.on_full = on_full
+        self.check_bytes = check_bytes
+        self.chunks = queue.Queue(maxsize=max_chunks)
+        self.full = threading.Event()
+        self.bytes_written = 0
+        self.segments = 0
+        self.dropped = 0
+        self.logs = utilities.Logs(app_name='Recorder')
+        self._file = None
+        self._path = None
+        self._since_check = 0
+
+    def put(self, name: str, data: bytes) -> None:
+        """ Queue a chunk for the segment file `name`. Never blocks. """
+        if self.full.is_set():
+            return
+        try:
+            self.chunks.put_nowait((name, data))
+        except queue.Full:
+            self.dropped += 1
+            self.logs.error("Recording is behind, dropped a %s byte chunk.", len(data))
+
+    def close(self) -> None:
+        """ Write everything queued, close the last segment and end the thread. """
+        self.chunks.put((None, None))
+        self.join()
+
+    def run(self) -> None:
+        while True:
+            name, data = self.chunks.get()
+            if name is None:
+                break
+            if self.full.is_set():
+                continue
+            try:
+                self.write(name, data)
+            except OSError as e:
+                # Keep draining the queue, so put() and close() never block on a dead writer
+                self.logs.error("Couldn't write recording, stopping it: %s", e)
+                self.full.set()
+        try:
+            self.close_segment()
+        except OSError as e:
+            self.logs.error("Couldn't finish the last recording segment: %s", e)
+        self.logs.info("Recording stopped: %s segments, %.1f MiB, %s chunks dropped",
+                       self.segments, self.bytes_written / 1024 / 1024, self.dropped)
+
+    def write(self, name: str, data: bytes) -> None:
+        """ Append a chunk to its segment, starting the segment if it's new. """
+        path = os.path.join(self.directory, name)
+        if path != self._path:
+            self.close_segment()
+            os.makedirs(self.directory, exist_ok=True)
+            if not self.make_room():
+                return
+            self._file = open(path, 'ab')
+            self._path = path
+            self.segments += 1
+            self.logs.info("Recording to %s", path)
+        elif self._since_check >= self.check_bytes and not self.make_room():
+            self.close_segment()
+            return
+        self._file.write(data)
+        self.bytes_written += len(data)
+        self._since_check += len(data)
+
+    def close_segment(self) -> None:
+        """ Flush the open segment to the SD card and close it. """
+        file, self._file, self._path = self._file, None, None
+        if file is not None:
+            try:
+                file.flush()
+                os.fsync(file.fileno())
+            finally:
+                file.close()
+
+    def make_room(self) -> bool:
+        """
+        Make sure at least `min_free` bytes are free, deleting old segments if rotating.
+
+        Returns:
+            bool: True if there's room to keep writing.
+        """
+        self._since_check = 0
+        while shutil.disk_usage(self.directory).free < self.min_free:
+            oldest = self.oldest_segment() if self.on_full == 'rotate' else None
+            if oldest is None:
+                self.logs.error("Less than %.0f MiB free, stopping the recording.", self.min_free / 1024 / 1024)
+                self.full.set()
+                return False
+            self.logs.info("Low on disk space, deleting old recording %s", oldest)
+            os.remove(oldest)
+        return True
+
+    def oldest_segment(self) -> str:
+        """ The oldest finished segment file in the directory, or None. """
+        segments = [entry for entry in os.scandir(self.directory)
+                    if entry.is_file() and entry.name.endswith('.webm') and entry.path != self._path]
+        if not segments:
+            return None
+        return min(segments, key=lambda entry: entry.stat().st_mtime).path
+
+
+class Recorder:
+    """
+    Record a meeting page with MediaRecorder into numbered segment files.
+
+    Must be used from the thread that owns the page; chunks arrive through an exposed function
+    while that thread waits in Playwright, and are handed to a SegmentWriter. Each start() (e.g.
+    after a rejoin) begins a new set of files, named after the time it started.
+    """
+
+    # Seconds between attempts to start, while the page has no tracks to record yet
+    RETRY_INTERVAL = 5.0
+
+    def __init__(self, settings: dict, name: str = 'main'):
+        """
+        Args:
+            settings: jitsi.env values, see jitsi.load_settings().
+            name: Session name, used in the file names.
+        """
+        self.name = name
+        self.logs = utilities.Logs(app_name='Recorder')
+        self.incoming = settings['RECORD_INCOMING'] == 'Yes'
+        try:
+            self.segment_ms = int(float(settings['RECORD_SEGMENT_SECONDS']) * 1000)
+            min_free = int(float(settings['RECORD_MIN_FREE_MB']) * 1024 * 1024)
+        except ValueError:
+            self.logs.error("Invalid RECORD_SEGMENT_SECONDS or RECORD_MIN_FREE_MB, using defaults.")
+            self.segment_ms, min_free = 300 * 1000, 500 * 1024 * 1024
+        on_full = 'stop' if settings['RECORD_ON_FULL'] == 'stop' else 'rotate'
+        self.writer = SegmentWriter(settings['RECORD_DIR'], min_free, on_full)
+        self.writer.start()
+        self.prefix = None
+        self.recording = False
+        self._pages = set()
+        self._last_try = 0.0
+
+    def start(self, page) -> bool:
+        """
+        Start recording the page's current tracks, in new files.
+
+        Returns:
+            bool: True if recording started, False if the page has no tracks to record yet.
+        """
+        self._last_try = time.monotonic()
+        if self.writer.full.is_set():
+            return False
+        # Exposed functions stay across navigations, so each page needs it once
+        if page not in self._pages:
+            page.expose_function('__streambotRecordChunk', self.on_chunk)
+            self._pages.add(page)
+        self.prefix = f"{time.strftime('%Y%m%d-%H%M%S')}-{self.name}"
+        options = {'incoming': self.incoming, 'segmentMs': self.segment_ms, 'timesliceMs': 1000,
+                   'videoBitsPerSecond': 1500000}
+        self.recording = bool(page.evaluate(START_JS, options))
+        if self.recording:
+            self.logs.info("Recording started: %s", self.prefix)
+        return self.recording
+
+    def on_chunk(self, segment: int, data: str) -> None:
+        """ Called from the page, on the page's thread, with a base64 chunk of segment `segment`. """
+        self.writer.put(f"{self.prefix}-{segment:04d}.webm", base64.b64decode(data))
+
+    def tick(self, page) -> None:
+        """ Start recording once the page has tracks, and stop once the writer has run out of disk space. """
+        if self.recording:
+            if self.writer.full.is_set():
+                self.stop(page)
+        elif not self.writer.full.is_set() and time.monotonic() - self._last_try >= self.RETRY_INTERVAL:
+            try:
+                self.start(page)
+            except Exception as e:
+                self.logs.error("Couldn't start recording: %s", e)
+
+    def stop(self, page) -> None:
+        """ Stop the page's recorder, and let its last chunk come through. """
+        if not self.recording:
+            return
+        self.recording = False
+        try:
+            page.evaluate(STOP_JS)
+            page.wait_for_timeout(500)
+        except Exception as e:
+            self.logs.debug("Couldn't stop the page's recorder: %s", e)
+
+    def close(self, page=None) -> None:
+        """ Stop recording and finish writing every queued chunk. """
+        if page is not None:
+            self.stop(page)
+        self.writer.close()
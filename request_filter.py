@@ -0,0 +1,143 @@
+"""Keep the meeting page from downloading what a headless bot doesn't need."""
+import re
+import base64
+import weakref
+import utilities
+
+# Resource classes blocked by default, as (class, URL glob, action). '*' matches anything,
+# '/' included, as in the DevTools protocol's URL patterns. 'stub' answers with an empty
+# response of the right type, for things the page waits on (scripts, styles, images); 'abort'
+# fails the request, for things fetched by code that already handles them being unavailable.
+DEFAULT_RULES = (
+    ('analytics', '*://www.google-analytics.com/*', 'stub'),
+    ('analytics', '*://*.googletagmanager.com/*', 'stub'),
+    ('analytics', '*://api*.amplitude.com/*', 'stub'),
+    ('analytics', '*://*.callstats.io/*', 'stub'),
+    ('analytics', '*/libs/analytics-ga*.js*', 'stub'),
+    ('fonts', '*://fonts.googleapis.com/*', 'stub'),
+    ('fonts', '*://fonts.gstatic.com/*', 'stub'),
+    ('avatars', '*://*.gravatar.com/*', 'stub'),
+    ('avatars', '*://*.libravatar.org/*', 'stub'),
+    ('models', '*.tflite*', 'abort'),
+    ('models', '*/libs/tflite*.wasm*', 'abort'),
+    ('models', '*/libs/face-landmarks-worker*.js*', 'abort'),
+    ('welcome', '*/images/welcome-background*', 'stub'),
+    ('welcome', '*/static/welcomePage*', 'stub'),
+)
+
+# A 1x1 transparent GIF, the stub for images
+BLANK_GIF = (b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\x00\x00\x00!\xf9\x04\x01\x00\x00\x00\x00'
+             b',\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;')
+
+# Stub content type and body for each DevTools resource type, anything else gets an empty body
+STUBS = {
+    'Script': ('application/javascript', b''),
+    'Stylesheet': ('text/css', b''),
+    'Image': ('image/gif', BLANK_GIF),
+    'Font': ('font/woff2', b''),
+}
+
+# The filter installed on each page, so rejoining on the same page doesn't intercept it twice
+_filters = weakref.WeakKeyDictionary()
+
+
+def compile_glob(pattern: str) -> re.Pattern:
+    """ A URL glob ('*' matches anything) as a compiled regex. """
+    return re.compile('^' + '.*'.join(re.escape(part) for part in pattern.split('*')) + '$')
+
+
+def attach(page, settings: dict, logs):
+    """
+    Install the request filter on a page, if REQUEST_FILTER is on. Call before navigating.
+
+    Args:
+        page: The meeting page.
+        settings: jitsi.env values, see jitsi.load_settings().
+        logs: Logger for the filter's reports.
+
+    Returns:
+        RequestFilter: The page's filter, or None if filtering is off.
+    """
+    if settings['REQUEST_FILTER'] != 'Yes':
+        return None
+    request_filter = _filters.get(page)
+    if request_filter is None:
+        request_filter = RequestFilter(settings['REQUEST_ALLOW'].split(), settings['REQUEST_DENY'].split(), logs)
+        request_filter.install(page)
+        _filters[page] = request_filter
+    return request_filter
+
+
+class RequestFilter:
+    """
+    Block or stub requests matching deny rules, unless they match an allow rule.
+
+    Requests are intercepted with the DevTools protocol's Fetch domain, given the rules as URL
+    patterns, so Chromium only pauses matching requests and everything else (the Jitsi bundle,
+    XMPP, media) never waits on Python. Playwright's page.route() would do the same, but turns
+    off the HTTP cache while any route is set, which would undo the persistent profile's cache.
+    Counts are kept per join, see log_join(). Must be used from the thread that owns the page.
+    """
+
+    def __init__(self, allow: list = (), deny: list = (), logs=None):
+        """
+        Args:
+            allow: URL globs never blocked, even if a deny rule matches.
+            deny: URL globs blocked (aborted) on top of DEFAULT_RULES.
+            logs: Logger, defaults to one named RequestFilter.
+        """
+        self.logs = logs or utilities.Logs(app_name='RequestFilter')
+        self.allow = [compile_glob(pattern) for pattern in allow]
+        rules = list(DEFAULT_RULES) + [('deny', pattern, 'abort') for pattern in deny]
+        self.rules = [(name, pattern, compile_glob(pattern), action) for name, pattern, action in rules]
+        self._cdp = None
+        self.reset()
+
+    def reset(self) -> None:
+        """ Start counting a new join. """
+        self.avoided = {}
+
+    def install(self, page) -> None:
+        """ Have Chromium pause the page's requests matching any rule, for on_paused() to answer. """
+        self._cdp = page.context.new_cdp_session(page)
+        self._cdp.on('Fetch.requestPaused', self.on_paused)
+        self._cdp.send('Fetch.enable', {'patterns': [{'urlPattern': pattern} for _name, pattern, _regex, _action in self.rules]})
+
+    def on_paused(self, params: dict) -> None:
+        """ Block or stub a request a rule matched, or let it through if an allow rule matches too. """
+        request_id = params['requestId']
+        url = params['request']['url']
+        rule = next((rule for rule in self.rules if rule[2].match(url)), None)
+        try:
+            if rule is None or any(pattern.match(url) for pattern in self.allow):
+                self._cdp.send('Fetch.continueRequest', {'requestId': request_id})
+                return
+            name, _pattern, _regex, action = rule
+            self.avoided[name] = self.avoided.get(name, 0) + 1
+            self.logs.debug("Blocked %s request: %s", name, url)
+            if action == 'abort':
+                self._cdp.send('Fetch.failRequest', {'requestId': request_id, 'errorReason': 'BlockedByClient'})
+                return
+            content_type, body = STUBS.get(params.get('resourceType'), ('text/plain', b''))
+            self._cdp.send('Fetch.fulfillRequest', {
+                'requestId': request_id,
+                'responseCode': 200,
+                'responseHeaders': [{'name': 'Content-Type', 'value': content_type}],
+                'body': base64.b64encode(body).decode('ascii')
+            })
+        except Exception as e:
+            # The request may be gone already, e.g. the page navigated away
+            self.logs.debug("Couldn't answer request %s: %s", url, e)
+
+    def log_join(self) -> None:
+        """
+        Log the requests avoided during this join, per class, and start counting the next.
+        Blocked requests never reach the network, so there's no size to report for them.
+        """
+        avoided = self.avoided
+        self.reset()
+        if not avoided:
+            self.logs.info("Request filter: nothing blocked this join.")
+            return
+        classes = ', '.join(f"{name} {count}" for name, count in sorted(avoided.items()))
+        self.logs.info("Request filter: avoided %s requests (%s)", sum(avoided.values()), classes)
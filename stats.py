@@ -0,0 +1,222 @@
+"""Sample WebRTC stats from the meeting page into a fixed-size ring buffer on disk."""
+import os
+import time
+import struct
+import utilities
+
+# Track every RTCPeerConnection the page makes, so getStats() can be called on them later.
+# Added as an init script, so it runs before Jitsi's own code on each navigation.
+TRACK_JS = """
+(() => {
+    if (window.__streambotPCs || !window.RTCPeerConnection) return;
+    const pcs = window.__streambotPCs = [];
+    const Native = window.RTCPeerConnection;
+    const Tracked = function (...args) {
+        const pc = new Native(...args);
+        pcs.push(pc);
+        return pc;
+    };
+    Tracked.prototype = Native.prototype;
+    Object.setPrototypeOf(Tracked, Native);
+    window.RTCPeerConnection = Tracked;
+})();
+"""
+
+# Sum the cumulative video send counters over all open peer connections
+SAMPLE_JS = """
+async () => {
+    const out = {bytes: 0, packets: 0, lost: 0, encoded: 0, captured: 0, fps: 0,
+                 width: 0, height: 0, rtt: 0, rttCount: 0, limitation: 'none'};
+    for (const pc of (window.__streambotPCs || [])) {
+        if (pc.connectionState === 'closed') continue;
+        const report = await pc.getStats();
+        report.forEach(s => {
+            if (s.type === 'outbound-rtp' && s.kind === 'video') {
+                out.bytes += s.bytesSent || 0;
+                out.packets += s.packetsSent || 0;
+                out.encoded += s.framesEncoded || 0;
+                out.fps = Math.max(out.fps, s.framesPerSecond || 0);
+                out.width = Math.max(out.width, s.frameWidth || 0);
+                out.height = Math.max(out.height, s.frameHeight || 0);
+                if (s.qualityLimitationReason && s.qualityLimitationReason !== 'none') {
+                    out.limitation = s.qualityLimitationReason;
+                }
+            } else if (s.type === 'remote-inbound-rtp' && s.kind === 'video') {
+                out.lost += s.packetsLost || 0;
+                if (s.roundTripTime !== undefined) { out.rtt += s.roundTripTime; out.rttCount += 1; }
+            } else if (s.type === 'media-source' && s.kind === 'video') {
+                out.captured += s.frames || 0;
+            }
+        });
+    }
+    return out;
+}
+"""
+
+# qualityLimitationReason values, stored as their index
+LIMITATIONS = ('none', 'cpu', 'bandwidth', 'other')
+
+# time, kbps, fps, dropped frames, rtt ms, loss %, width, height, limitation
+RECORD = struct.Struct('<dfffffHHB3x')
+# magic, version, record size, capacity, next slot, records written
+HEADER = struct.Struct('<4sHHIIQ')
+MAGIC = b'SBST'
+
+
+class StatsRing:
+    """
+    Fixed-size ring of stats records, in memory and in a preallocated file.
+
+    Memory and file size never grow: new records overwrite the oldest slot. Records are
+    written to disk in chunks of `flush_every`, to keep SD card writes few and small.
+    """
+
+    def __init__(self, path: str, capacity: int = 1800, flush_every: int = 15):
+        """
+        Args:
+            path: Ring file, created (or reset) at the full size.
+            capacity: Number of records kept, 1800 is an hour at 2s intervals.
+            flush_every: Records buffered before they are written to disk.
+        """
+        self.path = path
+        self.capacity = capacity
+        self.flush_every = flush_every
+        self.buffer = bytearray(RECORD.size * capacity)
+        self.next = 0
+        self.count = 0
+        self._unflushed = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.ftruncate(self._fd, HEADER.size + len(self.buffer))
+        self._write_header()
+
+    def append(self, record: tuple) -> None:
+        """ Add a record (fields as in RECORD), overwriting the oldest once full. """
+        RECORD.pack_into(self.buffer, self.next * RECORD.size, *record)
+        self.next = (self.next + 1) % self.capacity
+        self.count += 1
+        self._unflushed += 1
+        if self._unflushed >= self.flush_every:
+            self.flush()
+
+    def flush(self) -> None:
+        """ Write buffered records to their slots in the file, wrapping if needed. """
+        pending = min(self._unflushed, self.capacity)
+        if not pending:
+            return
+        start = (self.next - pending) % self.capacity
+        view = memoryview(self.buffer)
+        end = start + pending
+        if end <= self.capacity:
+            os.pwrite(self._fd, view[start * RECORD.size:end * RECORD.size], HEADER.size + start * RECORD.size)
+        else:
+            os.pwrite(self._fd, view[start * RECORD.size:], HEADER.size + start * RECORD.size)
+            os.pwrite(self._fd, view[:(end - self.capacity) * RECORD.size], HEADER.size)
+        self._write_header()
+        self._unflushed = 0
+
+    def close(self) -> None:
+        """ Flush and close the file. """
+        self.flush()
+        os.close(self._fd)
+
+    def _write_header(self) -> None:
+        os.pwrite(self._fd, HEADER.pack(MAGIC, 1, RECORD.size, self.capacity, self.next, self.count), 0)
+
+    @staticmethod
+    def read(path: str) -> list:
+        """
+        Read the records in a ring file, oldest first.
+
+        Args:
+            path: Ring file written by StatsRing.
+
+        Returns:
+            list: Record tuples, as in RECORD.
+        """
+        with open(path, 'rb') as f:
+            magic, _version, size, capacity, next_slot, count = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or size != RECORD.size:
+                raise ValueError(f"Not a stats ring file: {path}")
+            data = f.read(size * capacity)
+        slots = range(next_slot - min(count, capacity), next_slot)
+        return [RECORD.unpack_from(data, (slot % capacity) * size) for slot in slots]
+
+
+class StatsSampler:
+    """
+    Pull getStats() from the meeting page on an interval, turn counters into rates,
+    and append them to a StatsRing. Must be used from the thread that owns the page.
+    """
+
+    def __init__(self, page, ring: StatsRing, interval: float = 2.0):
+        """
+        Args:
+            page: The meeting page, before it navigates to the meeting.
+            ring: Where samples are stored.
+            interval: Seconds between samples.
+        """
+        self.ring = ring
+        self.interval = interval
+        self.latest = None
+        self.logs = utilities.Logs(app_name='Stats')
+        self._last = None
+        self._last_sample = 0.0
+        page.add_init_script(TRACK_JS)
+
+    def reset(self) -> None:
+        """ Forget the last counters, e.g. after the page rejoined and its peer connections started over. """
+        self._last = None
+
+    def tick(self, page) -> dict:
+        """
+        Take a sample if `interval` has passed. Call often from the page's thread.
+
+        Args:
+            page: The meeting page.
+
+        Returns:
+            dict: The new sample, or None if none was taken.
+        """
+        now = time.monotonic()
+        if now - self._last_sample < self.interval:
+            return None
+        self._last_sample = now
+        try:
+            raw = page.evaluate(SAMPLE_JS)
+        except Exception as e:
+            self.logs.debug("Couldn't read WebRTC stats: %s", e)
+            return None
+        last, self._last = self._last, (now, raw)
+        if last is None:
+            return None
+        elapsed = now - last[0]
+        prev = last[1]
+        sent = raw['packets'] - prev['packets']
+        lost = raw['lost'] - prev['lost']
+        sample = {
+            'kbps': max(raw['bytes'] - prev['bytes'], 0) * 8 / 1000 / elapsed,
+            'fps': raw['fps'],
+            'dropped': max((raw['captured'] - prev['captured']) - (raw['encoded'] - prev['encoded']), 0),
+            'rtt_ms': raw['rtt'] / raw['rttCount'] * 1000 if raw['rttCount'] else 0.0,
+            'loss_pct': lost / sent * 100 if sent > 0 and lost > 0 else 0.0,
+            'width': raw['width'],
+            'height': raw['height'],
+            'limitation': raw['limitation'] if raw['limitation'] in LIMITATIONS else 'other',
+        }
+        self.ring.append((time.time(), sample['kbps'], sample['fps'], sample['dropped'], sample['rtt_ms'],
+                          sample['loss_pct'], sample['width'], sample['height'],
+                          LIMITATIONS.index(sample['limitation'])))
+        self.latest = sample
+        return sample
+
+    @staticmethod
+    def summary(sample: dict) -> str:
+        """ Short multi-line readout of a sample for the sidebar. """
+        text = (f"{sample['kbps'] / 1000:.1f} Mbps {sample['fps']:.0f} fps {sample['height']}p\n"
+                f"RTT {sample['rtt_ms']:.0f} ms, loss {sample['loss_pct']:.1f}%")
+        if sample['dropped']:
+            text += f"\n{sample['dropped']:.0f} frames dropped"
+        if sample['limitation'] != 'none':
+            text += f"\nLimited by {sample['limitation']}"
+        return text
@@ -0,0 +1,422 @@
+"""Run one or more camera sessions in a shared Chromium, within the Pi's video encode budget, and rejoin them when they drop."""
+import os
+import time
+import utilities
+import jitsi
+from quality import LEVELS, QualityController
+from stats import StatsRing, StatsSampler
+from recorder import Recorder
+
+
+def allocate_encode(requests: list, budget: int) -> list:
+    """
+    Scale capture sizes so all sessions together stay within an encode budget.
+
+    Each session keeps its aspect ratio and steps down through quality.LEVELS, then drops
+    frame rate (to no less than 5 fps) if even the lowest level is over its share.
+
+    Args:
+        requests: (width, height, fps) asked for by each session.
+        budget: Total pixels per second the Pi may encode.
+
+    Returns:
+        list: (width, height, fps) for each session, in the same order.
+    """
+    total = sum(w * h * f for w, h, f in requests)
+    if total <= budget or total == 0:
+        return list(requests)
+    scale = budget / total
+    allocated = []
+    for width, height, fps in requests:
+        share = width * height * fps * scale
+        for level in [height] + [level for level in LEVELS if level < height]:
+            level_width = round(width * level / height)
+            if level_width * level * fps <= share:
+                allocated.append((level_width, level, fps))
+                break
+        else:
+            allocated.append((level_width, level, max(5, int(share / (level_width * level)))))
+    return allocated
+
+
+def backoff(attempt: int, start: float, limit: float) -> float:
+    """ Seconds to wait after failed attempt `attempt` (from 1): start, then doubling, up to limit. """
+    return min(start * 2 ** (attempt - 1), limit)
+
+
+class Session:
+    """One participant in the meeting: a page in the shared browser, joined with its own settings."""
+
+    def __init__(self, name: str, settings: dict, context, page, owns_context: bool):
+        self.name = name
+        self.settings = settings
+        self.context = context
+        self.page = page
+        self.owns_context = owns_context
+        self.joined = False
+        self.quality = None
+        self.stats = None
+        self.recorder = None
+        self.summary = ''
+        self.error = ''
+        # Set while the session is out of the meeting and waiting to be rejoined
+        self.down_since = None
+        self.down_reason = ''
+        self.page_lost = False
+        self.attempts = 0
+        self.next_attempt = 0.0
+        self.last_check = 0.0
+        self.not_joined_since = None
+
+
+class SessionSupervisor:
+    """
+    Join every configured camera session, run their periodic work, and rejoin any that drop.
+
+    All sessions share the leased browser: the first uses the lease's page, later ones get
+    their own context (or page, for a persistent profile) so they don't cost another Chromium.
+    Sessions join one after another, so the Pi only pays one join's CPU spike at a time, and
+    their capture sizes are scaled to fit ENCODE_BUDGET together.
+
+    A session counts as dropped when its page crashes or closes, the browser disconnects, or
+    the page stops reporting a joined conference. It is rejoined with exponential backoff: on
+    the same page if that is still alive, in a new page if not, and in a relaunched browser
+    only if the browser itself is gone. Must be used from the thread that owns the browser.
+    """
+
+    # Seconds between conference state checks on each page
+    CHECK_INTERVAL = 2.0
+
+    # Seconds a page may report not being joined, without showing an error, before it counts
+    # as dropped. Covers Jitsi's own reconnects, which briefly leave the conference.
+    LOST_GRACE = 8.0
+
+    # Seconds to wait after the first failed rejoin, doubled after each further failure
+    BACKOFF_START = 1.0
+    BACKOFF_MAX = 60.0
+
+    def __init__(self, lease, report, stats_dir: str = 'Logs', leave=None, relaunch=None):
+        """
+        Args:
+            lease: The BrowserPool lease to run the sessions in.
+            report: Callable(state, detail) for meeting-level states.
+            stats_dir: Directory for each session's WebRTC stats ring file.
+            leave: Optional threading.Event; once it is set, joins and rejoins in progress are
+                cancelled and no new ones start.
+            relaunch: Optional callable(lease) that closes a lease whose browser died and returns
+                a new one. Without it, sessions can't recover from a browser disconnect.
+        """
+        self.lease = lease
+        self.report = report
+        self.stats_dir = stats_dir
+        self.leave = leave
+        self.relaunch = relaunch
+        self.sessions = []
+        self.reconnects = 0
+        self.downtime = 0.0
+        self.logs = utilities.Logs(app_name='Supervisor')
+        self._browser_lost = False
+        self._closing = False
+        self.watch_browser()
+
+    def start(self, sessions: list) -> bool:
+        """
+        Join all sessions. If any joined, the ones that didn't are retried from tick().
+        Once `leave` is set, the join in progress is cancelled and no further session joins.
+
+        Args:
+            sessions: Settings for each session, see jitsi.load_sessions().
+
+        Returns:
+            bool: True if at least one session joined. If none did, each session's `error` says why.
+        """
+        try:
+            budget = int(sessions[0]['ENCODE_BUDGET'])
+        except ValueError:
+            self.logs.error("Invalid ENCODE_BUDGET: %s", sessions[0]['ENCODE_BUDGET'])
+            budget = int(jitsi.OPTIONAL_SETTINGS['ENCODE_BUDGET'])
+        requests = [(int(s['VIDEO_WIDTH']), int(s['VIDEO_HEIGHT']), int(s['VIDEO_FPS'])) for s in sessions]
+        allocated = allocate_encode(requests, budget)
+
+        for index, (settings, (width, height, fps)) in enumerate(zip(sessions, allocated)):
+            if self.leaving():
+                break
+            settings = dict(settings, VIDEO_WIDTH=str(width), VIDEO_HEIGHT=str(height), VIDEO_FPS=str(fps))
+            if (width, height, fps) != requests[index]:
+                self.logs.info("Session %s capped to %sx%s@%s to fit the encode budget",
+                               settings['SESSION'], width, height, fps)
+            # Only the first session sends audio, several microphones in one room would echo
+            if index > 0:
+                settings['START_AUDIO_MUTED'] = 'Yes'
+            context, page, owns_context = self.new_page(index)
+            session = Session(settings['SESSION'], settings, context, page, owns_context)
+            self.sessions.append(session)
+            self.prepare(session)
+            if jitsi.join(session.page, settings, self.session_report(session), self.logs, self.leave):
+                self.on_joined(session)
+
+        if self.leaving() or not any(session.joined for session in self.sessions):
+            return any(session.joined for session in self.sessions)
+        for session in self.sessions:
+            if not session.joined:
+                self.lost(session, session.error or 'failed to join')
+        return True
+
+    def new_page(self, index: int) -> tuple:
+        """ A (context, page, owns_context) for the session at `index`, in the shared browser. """
+        if index == 0:
+            return self.lease.context, self.lease.page, False
+        if self.lease.browser is not None:
+            context = self.lease.browser.new_context()
+            return context, context.new_page(), True
+        # A persistent profile is one context; extra sessions are pages in it
+        return self.lease.context, self.lease.context.new_page(), False
+
+    def prepare(self, session: Session) -> None:
+        """ Set up a session's fresh page: pin its camera, track its stats and watch for it dying. """
+        device = session.settings['DEVICE']
+        if device:
+            label = jitsi.device_label(device)
+            if label:
+                index, count = jitsi.device_index(device)
+                if count > 1:
+                    self.logs.info("Session %s: %s cameras are named %s, using number %s in /dev/video order",
+                                   session.name, count, label, index + 1)
+                session.page.add_init_script(jitsi.camera_script(label, index))
+            else:
+                self.logs.error("Couldn't find camera %s for session %s", device, session.name)
+        if session.stats is None:
+            first = self.sessions.index(session) == 0
+            ring_name = 'webrtc-stats.bin' if first else f'webrtc-stats-{session.name}.bin'
+            ring = StatsRing(os.path.join(self.stats_dir, ring_name))
+        else:
+            ring = session.stats.ring
+        session.stats = StatsSampler(session.page, ring)
+        session.page.on('crash', lambda page: self.on_page_gone(session, page, 'page crashed'))
+        session.page.on('close', lambda page: self.on_page_gone(session, page, 'page closed'))
+
+    def watch_browser(self) -> None:
+        """ Drop every session if the lease's browser goes away. """
+        if self.lease.browser is not None:
+            self.lease.browser.on('disconnected', self.on_browser_gone)
+        else:
+            self.lease.context.on('close', self.on_browser_gone)
+
+    def session_report(self, session: Session):
+        """ Pass a session's join steps on, keeping per-session failures and rejoins out of the meeting state. """
+        def report(state: str, detail: str = '') -> None:
+            if state == 'failed':
+                session.error = detail
+                self.logs.error("Session %s failed: %s", session.name, detail)
+            elif session.down_since is not None:
+                self.logs.debug("Session %s rejoining: %s %s", session.name, state, detail)
+            else:
+                self.report(state, detail if len(self.sessions) == 1 else session.name)
+        return report
+
+    def on_joined(self, session: Session) -> None:
+        """ Start a joined session's in-meeting work. """
+        self.logs.info("Session %s joined", session.name)
+        session.joined = True
+        session.error = ''
+        session.not_joined_since = None
+        session.last_check = time.monotonic()
+        session.stats.reset()
+        if session.settings['ADAPTIVE_QUALITY'] == 'Yes':
+            session.quality = QualityController(max_height=int(session.settings['VIDEO_HEIGHT']))
+        # Only the first session is recorded, it's the one sending audio
+        if session.settings['RECORD'] == 'Yes' and session is self.sessions[0]:
+            if session.recorder is None:
+                session.recorder = Recorder(session.settings, session.name)
+            session.recorder.start(session.page)
+
+    def lost(self, session: Session, reason: str, page_lost: bool = False) -> None:
+        """ Mark a session as dropped, to be rejoined from tick(). Safe to call from Playwright event handlers. """
+        if self._closing:
+            return
+        session.page_lost = session.page_lost or page_lost
+        if session.down_since is not None:
+            return
+        session.joined = False
+        session.quality = None
+        if session.recorder is not None:
+            # The page's recorder goes with the page or its navigation, it's restarted on rejoin
+            session.recorder.recording = False
+        session.down_since = time.monotonic()
+        session.down_reason = reason
+        session.attempts = 0
+        session.next_attempt = session.down_since
+        self.logs.error("Session %s dropped: %s", session.name, reason)
+        self.report('reconnecting', reason if len(self.sessions) == 1 else f"{session.name}: {reason}")
+
+    def on_page_gone(self, session: Session, page, reason: str) -> None:
+        """ A session's page crashed or closed. Events from pages it already replaced are ignored. """
+        if page is session.page:
+            self.lost(session, reason, page_lost=True)
+
+    def on_browser_gone(self, browser) -> None:
+        """ The browser or persistent context went away, taking every session with it. """
+        if self._closing or browser not in (self.lease.browser, self.lease.context):
+            return
+        self._browser_lost = True
+        for session in self.sessions:
+            self.lost(session, 'browser disconnected', page_lost=True)
+
+    def leaving(self) -> bool:
+        """ True once the meeting has been asked to end. """
+        return self.leave is not None and self.leave.is_set()
+
+    def wait(self, ms: int) -> None:
+        """ Sleep for `ms` while letting Playwright deliver events for every session. """
+        for session in self.sessions:
+            if session.page_lost:
+                continue
+            try:
+                session.page.wait_for_timeout(ms)
+                return
+            except Exception as e:
+                self.lost(session, f"page stopped responding: {e}", page_lost=True)
+        time.sleep(ms / 1000)
+
+    def tick(self) -> str:
+        """
+        Check each session, rejoin dropped ones that are due, and run joined sessions'
+        quality controller and stats sampler.
+
+        Returns:
+            str: A new stats readout for the UI, or None if nothing changed.
+        """
+        updated = False
+        for session in self.sessions:
+            if session.down_since is not None:
+                if time.monotonic() >= session.next_attempt and not self.leaving():
+                    updated = self.recover(session) or updated
+                continue
+            self.check(session)
+            if not session.joined:
+                continue
+            if session.quality is not None:
+                session.quality.tick(session.page)
+            if session.recorder is not None:
+                session.recorder.tick(session.page)
+            sample = session.stats.tick(session.page)
+            if sample is not None:
+                session.summary = StatsSampler.summary(sample)
+                updated = True
+        if not updated:
+            return None
+        if len(self.sessions) == 1:
+            text = self.sessions[0].summary
+        else:
+            text = '\n'.join(f"{session.name}: {session.summary.splitlines()[0]}" if session.joined and session.summary
+                             else f"{session.name}: {'waiting for stats' if session.joined else 'reconnecting'}"
+                             for session in self.sessions)
+        if self.reconnects:
+            text += f"\nReconnects: {self.reconnects} ({self.downtime:.0f}s down)"
+        return text
+
+    def check(self, session: Session) -> None:
+        """ Every CHECK_INTERVAL, make sure a joined session's page is still in the conference. """
+        now = time.monotonic()
+        if now - session.last_check < self.CHECK_INTERVAL:
+            return
+        session.last_check = now
+        try:
+            state = jitsi.conference_state(session.page)
+        except Exception as e:
+            self.lost(session, f"page stopped responding: {e}", page_lost=True)
+            return
+        if state == 'joined':
+            session.not_joined_since = None
+        elif state == 'error':
+            self.lost(session, 'Jitsi showed an error')
+        elif session.not_joined_since is None:
+            session.not_joined_since = now
+        elif now - session.not_joined_since >= self.LOST_GRACE:
+            self.lost(session, 'dropped out of the conference')
+
+    def recover(self, session: Session) -> bool:
+        """
+        Try once to rejoin a dropped session, reusing as much of the browser as still works.
+
+        Returns:
+            bool: True if the session is back in the meeting.
+        """
+        session.attempts += 1
+        self.logs.info("Rejoining session %s, attempt %s", session.name, session.attempts)
+        try:
+            if self._browser_lost:
+                self.restart_browser()
+            if session.page_lost:
+                self.reopen(session)
+            joined = jitsi.join(session.page, session.settings, self.session_report(session), self.logs, self.leave)
+        except Exception as e:
+            self.logs.error("Couldn't rejoin session %s: %s", session.name, e)
+            joined = False
+        if not joined:
+            delay = backoff(session.attempts, self.BACKOFF_START, self.BACKOFF_MAX)
+            session.next_attempt = time.monotonic() + delay
+            self.logs.info("Session %s will retry in %.0fs", session.name, delay)
+            return False
+
+        down = time.monotonic() - session.down_since
+        session.down_since = None
+        self.reconnects += 1
+        self.downtime += down
+        self.on_joined(session)
+        self.logs.info("Session %s back after %.1fs (%s, %s attempts); %s reconnects, %.1fs down in total",
+                       session.name, down, session.down_reason, session.attempts, self.reconnects, self.downtime)
+        if all(s.down_since is None for s in self.sessions):
+            self.report('joined', f"Reconnected after {down:.0f}s")
+        return True
+
+    def restart_browser(self) -> None:
+        """ Swap the dead browser for a new one. Every session's page and context went with it. """
+        if self.relaunch is None:
+            raise RuntimeError("The browser disconnected and can't be relaunched.")
+        self.logs.info("Browser disconnected, relaunching.")
+        self.lease = self.relaunch(self.lease)
+        self._browser_lost = False
+        self.watch_browser()
+        for session in self.sessions:
+            session.page_lost = True
+            session.context = None
+
+    def reopen(self, session: Session) -> None:
+        """ Give a session whose page crashed or closed a new one in the live browser. """
+        index = self.sessions.index(session)
+        try:
+            if session.owns_context and session.context is not None:
+                session.context.close()
+            elif not session.page.is_closed():
+                session.page.close()
+        except Exception as e:
+            self.logs.debug("Error closing dead page of session %s: %s", session.name, e)
+        if index == 0 and session.context is not None:
+            # Same browser, but the lease's page is gone: the new one takes its place
+            self.lease.page = self.lease.context.new_page()
+        session.context, session.page, session.owns_context = self.new_page(index)
+        session.page_lost = False
+        self.prepare(session)
+
+    def close(self) -> None:
+        """ Close every session's own page or context. The lease itself is released by the caller. """
+        self._closing = True
+        if self.reconnects:
+            self.logs.info("Meeting had %s reconnects, %.1fs down in total", self.reconnects, self.downtime)
+        for index, session in enumerate(self.sessions):
+            # A session whose prepare() failed never got a stats sampler
+            if session.stats is not None:
+                session.stats.ring.close()
+            if session.recorder is not None:
+                session.recorder.close(None if session.page_lost else session.page)
+            if index == 0 or session.page_lost:
+                continue
+            try:
+                if session.owns_context:
+                    session.context.close()
+                else:
+                    session.page.close()
+            except Exception as e:
+                self.logs.debug("Error closing session %s: %s", session.name, e)
+        self.sessions = []
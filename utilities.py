@@ -1,8 +1,14 @@
 """Noah's common python utilities"""
 import os
+import time
+import queue
+import atexit
 import logging
-import datetime
+import logging.handlers
+import tempfile
+import threading
 import configparser
+from types import MappingProxyType
 
 class Ini:
     """Interact with .ini files."""
@@ -19,14 +25,7 @@ class Ini:
             'success' is False if an exception occurs. 
             'result' lists each section in the .ini, or a string of the exception that occurred.
         """
-        try:
-            config = configparser.ConfigParser()
-            config.read(file)
-            sections = config.sections()
-            return {'success': True, 'result': sections}
-        except (configparser.NoSectionError, configparser.NoOptionError,
-                configparser.ParsingError, FileNotFoundError, IOError, OSError) as e:
-            return {'success': False, 'result': str(e)}
+        return Settings.get_sections(file)
 
     @staticmethod
     def load(file: str, section: str, key: str) -> dict:
@@ -43,23 +42,13 @@ class Ini:
             'success' is False if an exception occurs.
             'result' contains the value of requested key, or string of the exception that occurred.
         """
-        try:
-            config = configparser.ConfigParser()
-            config.read(file)
-            if section not in config:
-                return {'success': False, 'result': f"Section '{section}' not found."}
-            if key not in config[section]:
-                return {'success': False, 'result': f"Key '{key}' not found: section '{section}'."}
-            value = config[section][key]
-            return {'success': True, 'result': value}
-        except (configparser.NoSectionError, configparser.NoOptionError,
-                configparser.ParsingError, FileNotFoundError, IOError, OSError) as e:
-            return {'success': False, 'result': str(e)}
+        return Settings.load(file, section, key)
 
     @staticmethod
     def write(file: str, section: str, key: str, value: str) -> dict:
         """
         Write a value to a key in a .ini file.
+        The file is replaced atomically, see Settings.transaction to write several keys at once.
 
         Args:
             file (str): The path to the .ini file.
@@ -72,21 +61,338 @@ class Ini:
             'success' is False if an exception occurs.
             'result' contains the value of the set key, or a string of the exception that occurred.
         """
+        with Settings.transaction(file) as tx:
+            tx.set(key, value, section=section)
+        if not tx.result['success']:
+            return tx.result
+        return {'success': True, 'result': value}
+
+class Settings:
+    """
+    Process-wide cache of parsed .ini files.
+
+    Each file is parsed once into an immutable snapshot, and only re-read when its
+    mtime or size changes. Lookups keep the {'success', 'result'} contract of Ini.
+    """
+    _lock = threading.Lock()
+    _cache = {}
+    _pending = {}
+    _timers = {}
+    # Values are kept raw and %-interpolated per key on lookup, like ConfigParser.get()
+    _interpolation = configparser.BasicInterpolation()
+    _keys = configparser.ConfigParser()
+
+    @staticmethod
+    def _stamp(file: str):
+        """ Return (mtime_ns, size) for a file, or None if it does not exist. """
+        try:
+            st = os.stat(file)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    @staticmethod
+    def _parse(file: str) -> MappingProxyType:
+        """
+        Parse a file into a read-only {section: {key: value}} mapping of raw values. Nothing is
+        interpolated here, so one bad '%' only affects lookups of its own key, see _value().
+        """
+        config = configparser.ConfigParser(interpolation=None)
+        config.read(file)
+        snapshot = {configparser.DEFAULTSECT: MappingProxyType(dict(config.defaults()))}
+        for section in config.sections():
+            snapshot[section] = MappingProxyType(dict(config.items(section)))
+        return MappingProxyType(snapshot)
+
+    @classmethod
+    def _value(cls, values, section: str, key: str) -> str:
+        """
+        A key's value from a snapshot section, with %-interpolation applied as ConfigParser.get() would.
+
+        Raises:
+            configparser.InterpolationError: If the value has a bad '%' or refers to a missing key.
+        """
+        value = values[key]
+        if '%' not in value:
+            return value
+        return cls._interpolation.before_get(cls._keys, section, key, value, values)
+
+    @classmethod
+    def snapshot(cls, file: str) -> MappingProxyType:
+        """
+        Fetch the current snapshot of a file, re-parsing it only if it changed on disk.
+
+        Args:
+            file (str): The path to the .ini file.
+
+        Returns:
+            MappingProxyType: Read-only mapping of section name to a read-only mapping of keys.
+            Missing files produce a snapshot with only an empty DEFAULT section.
+        """
+        path = os.path.abspath(file)
+        stamp = cls._stamp(path)
+        with cls._lock:
+            cached = cls._cache.get(path)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+        snapshot = cls._parse(path)
+        with cls._lock:
+            cls._cache[path] = (stamp, snapshot)
+        return snapshot
+
+    @classmethod
+    def invalidate(cls, file: str = None) -> None:
+        """
+        Drop the cached snapshot of a file, or every snapshot if no file is given.
+
+        Args:
+            file (str): The path to the .ini file.
+        """
+        with cls._lock:
+            if file is None:
+                cls._cache.clear()
+            else:
+                cls._cache.pop(os.path.abspath(file), None)
+
+    @classmethod
+    def get_sections(cls, file: str) -> dict:
+        """
+        Check all the sections in a .ini file.
+
+        Args:
+            file (str): The path to the .ini file.
+
+        Returns:
+            dict: Dictionary with keys 'success' and 'result'.
+            'success' is False if an exception occurs.
+            'result' lists each section in the .ini, or a string of the exception that occurred.
+        """
+        try:
+            sections = [s for s in cls.snapshot(file) if s != configparser.DEFAULTSECT]
+            return {'success': True, 'result': sections}
+        except (configparser.Error, IOError, OSError) as e:
+            return {'success': False, 'result': str(e)}
+
+    @classmethod
+    def load(cls, file: str, section: str, key: str) -> dict:
+        """
+        Load the value of a key from a .ini file.
+
+        Args:
+            file (str): The path to the .ini file.
+            section (str): The section of the key to load.
+            key (str): The key to load.
+
+        Returns:
+            dict: Dictionary with keys 'success' and 'result'.
+            'success' is False if an exception occurs.
+            'result' contains the value of requested key, or string of the exception that occurred.
+        """
+        try:
+            snapshot = cls.snapshot(file)
+            if section not in snapshot:
+                return {'success': False, 'result': f"Section '{section}' not found."}
+            values = snapshot[section]
+            if key.lower() not in values:
+                return {'success': False, 'result': f"Key '{key}' not found: section '{section}'."}
+            return {'success': True, 'result': cls._value(values, section, key.lower())}
+        except (configparser.Error, IOError, OSError) as e:
+            return {'success': False, 'result': str(e)}
+
+    @classmethod
+    def get_many(cls, file: str, keys, section: str = configparser.DEFAULTSECT) -> dict:
+        """
+        Load several keys from one section of a .ini file with a single snapshot lookup.
+
+        Args:
+            file (str): The path to the .ini file.
+            keys (iterable): The keys to load.
+            section (str): The section of the keys to load. Defaults to DEFAULT.
+
+        Returns:
+            dict: Dictionary with keys 'success', 'result' and 'missing'.
+            'success' is False if an exception occurs or the section is missing.
+            'result' maps each found key to its value, or a string of the exception that occurred.
+            'missing' lists the requested keys that were not found, or whose value can't be interpolated.
+        """
         try:
-            if not Files.check_exist(file)['result']:
-                Files.create(file)
-            config = configparser.ConfigParser()
-            config.read(file)
-            if not config.has_section(section):
-                config.add_section(section)
-            config.set(section, key, value)
-            with open(file, 'w', encoding='utf-8') as configfile:
-                config.write(configfile)
-            return {'success': True, 'result': value}
-        except (configparser.NoSectionError, configparser.ParsingError,
-                FileNotFoundError, IOError) as e:
+            snapshot = cls.snapshot(file)
+            if section not in snapshot:
+                return {'success': False, 'result': f"Section '{section}' not found.",
+                        'missing': list(keys)}
+            values = snapshot[section]
+            found, missing = {}, []
+            for key in keys:
+                try:
+                    found[key] = cls._value(values, section, key.lower())
+                except (KeyError, configparser.InterpolationError):
+                    missing.append(key)
+            return {'success': True, 'result': found, 'missing': missing}
+        except (configparser.Error, IOError, OSError) as e:
+            return {'success': False, 'result': str(e), 'missing': list(keys)}
+
+    @classmethod
+    def transaction(cls, file: str) -> 'SettingsTransaction':
+        """
+        Start a write transaction on a .ini file.
+
+        Usage:
+            with Settings.transaction(file) as tx:
+                tx.set('KEY', 'value')
+
+        All changes are written together in a single atomic replace when the block exits,
+        and the outcome is left in tx.result as a {'success', 'result'} dictionary.
+
+        Args:
+            file (str): The path to the .ini file.
+        """
+        return SettingsTransaction(file)
+
+    @classmethod
+    def write_later(cls, file: str, key: str, value: str,
+                    section: str = configparser.DEFAULTSECT, delay: float = 1.0) -> None:
+        """
+        Queue a write that is coalesced with any other writes to the same file within `delay`.
+
+        Rapidly repeated changes (e.g. a dropdown) reach the disk as one write. Pending writes
+        are flushed on interpreter exit, or early with Settings.flush().
+
+        Args:
+            file (str): The path to the .ini file.
+            key (str): The key to modify.
+            value (str): The value of the key.
+            section (str): The section of the key to modify. Defaults to DEFAULT.
+            delay (float): Seconds to wait for further writes before flushing.
+        """
+        path = os.path.abspath(file)
+        with cls._lock:
+            cls._pending.setdefault(path, {})[(section, key)] = value
+            timer = cls._timers.pop(path, None)
+            if timer is not None:
+                timer.cancel()
+            timer = threading.Timer(delay, cls.flush, args=(path,))
+            timer.daemon = True
+            cls._timers[path] = timer
+            timer.start()
+
+    @classmethod
+    def flush(cls, file: str = None) -> dict:
+        """
+        Write out pending coalesced writes now.
+
+        Args:
+            file (str): The path to the .ini file, or None to flush every file.
+
+        Returns:
+            dict: Dictionary with keys 'success' and 'result'.
+            'success' is False if any write failed.
+            'result' lists the flushed files, or a string of the exception that occurred.
+        """
+        with cls._lock:
+            paths = [os.path.abspath(file)] if file is not None else list(cls._pending)
+            batches = {}
+            for path in paths:
+                timer = cls._timers.pop(path, None)
+                if timer is not None:
+                    timer.cancel()
+                if path in cls._pending:
+                    batches[path] = cls._pending.pop(path)
+        for path, changes in batches.items():
+            with cls.transaction(path) as tx:
+                for (section, key), value in changes.items():
+                    tx.set(key, value, section=section)
+            if not tx.result['success']:
+                return tx.result
+        return {'success': True, 'result': list(batches)}
+
+class SettingsTransaction:
+    """Collect changes to a .ini file and commit them with one atomic write."""
+
+    # Serialises read-modify-write cycles so concurrent transactions can't drop each other's keys
+    _commit_lock = threading.Lock()
+
+    def __init__(self, file: str):
+        self.file = file
+        self.changes = {}
+        self.result = {'success': False, 'result': 'Transaction not committed.'}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.result = self.commit()
+        return False
+
+    def set(self, key: str, value: str, section: str = configparser.DEFAULTSECT) -> None:
+        """
+        Stage a value for a key.
+
+        Args:
+            key (str): The key to modify.
+            value (str): The value of the key.
+            section (str): The section of the key to modify. Defaults to DEFAULT.
+        """
+        self.changes[(section, key)] = value
+
+    def commit(self) -> dict:
+        """
+        Write staged changes to a temp file, fsync it, and os.replace it over the original.
+
+        Returns:
+            dict: Dictionary with keys 'success' and 'result'.
+            'success' is False if an exception occurs.
+            'result' contains the number of keys written, or a string of the exception that occurred.
+        """
+        if not self.changes:
+            return {'success': True, 'result': 0}
+        path = os.path.abspath(self.file)
+        directory = os.path.dirname(path)
+        try:
+            with self._commit_lock:
+                os.makedirs(directory, exist_ok=True)
+                config = configparser.ConfigParser()
+                config.read(path)
+                for (section, key), value in self.changes.items():
+                    if section != configparser.DEFAULTSECT and not config.has_section(section):
+                        config.add_section(section)
+                    config.set(section, key, value)
+                fd, tmp = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.")
+                try:
+                    # mkstemp creates 0600 files, keep the mode a plain open() would have given
+                    try:
+                        mode = os.stat(path).st_mode & 0o777
+                    except FileNotFoundError:
+                        umask = os.umask(0)
+                        os.umask(umask)
+                        mode = 0o666 & ~umask
+                    os.chmod(tmp, mode)
+                    with os.fdopen(fd, 'w', encoding='utf-8') as configfile:
+                        if not config.defaults():
+                            configfile.write('[DEFAULT]\n\n')  # Keep the placeholder Files.create writes
+                        config.write(configfile)
+                        configfile.flush()
+                        os.fsync(configfile.fileno())
+                    os.replace(tmp, path)
+                except BaseException:
+                    os.remove(tmp)
+                    raise
+                # Persist the rename itself, not just the file contents
+                try:
+                    dir_fd = os.open(directory, os.O_RDONLY)
+                    try:
+                        os.fsync(dir_fd)
+                    finally:
+                        os.close(dir_fd)
+                except OSError:
+                    pass
+                Settings.invalidate(path)
+            return {'success': True, 'result': len(self.changes)}
+        except (configparser.Error, ValueError, IOError, OSError) as e:
             return {'success': False, 'result': str(e)}
 
+atexit.register(Settings.flush)
+
 class Files:
     """Interact with files."""
 
@@ -157,18 +463,108 @@ class Files:
         except (OSError, IOError) as e:
             return {'success': False, 'result': str(e)}
 
+class _BatchFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    Rotating file handler that rolls over on size or age, and only flushes to disk every
+    `flush_interval` seconds (or straight away for errors), so the SD card sees batched writes.
+    Only used from the log listener thread.
+    """
+
+    def __init__(self, filename: str, max_bytes: int, backup_count: int,
+                 rotate_interval: float, flush_interval: float):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self.rotate_interval = rotate_interval
+        self.flush_interval = flush_interval
+        self._rollover_at = time.time() + rotate_interval
+        self._last_flush = time.monotonic()
+        self._dirty = False
+        # Track the file size ourselves: the base class seeks the stream to check it, which flushes every record
+        self._size = os.path.getsize(filename) if os.path.exists(filename) else 0
+        self._record_size = 0
+
+    def shouldRollover(self, record) -> bool:
+        self._record_size = len(self.format(record).encode('utf-8')) + len(self.terminator)
+        if self._size == 0:
+            return False
+        if time.time() >= self._rollover_at:
+            return True
+        return self.maxBytes > 0 and self._size + self._record_size >= self.maxBytes
+
+    def doRollover(self) -> None:
+        super().doRollover()
+        self._rollover_at = time.time() + self.rotate_interval
+        self._size = 0
+
+    def emit(self, record) -> None:
+        self._dirty = True
+        super().emit(record)
+        self._size += self._record_size
+        if record.levelno >= logging.ERROR:
+            self.flush(force=True)
+
+    def flush(self, force: bool = False) -> None:
+        # StreamHandler.emit flushes after every record, only let the batched flushes through
+        if not force and time.monotonic() - self._last_flush < self.flush_interval:
+            return
+        if self._dirty:
+            super().flush()
+            self._dirty = False
+        self._last_flush = time.monotonic()
+
+    def close(self) -> None:
+        self.flush(force=True)
+        super().close()
+
+
+class _BatchQueueListener(logging.handlers.QueueListener):
+    """Queue listener that wakes up every `flush_interval` to flush batched records when idle."""
+
+    def __init__(self, log_queue: queue.Queue, handler: _BatchFileHandler):
+        super().__init__(log_queue, handler)
+        self.handler = handler
+
+    def dequeue(self, block: bool):
+        while True:
+            try:
+                return self.queue.get(block, self.handler.flush_interval)
+            except queue.Empty:
+                self.handler.flush()
+
+
 class Logs:
     """Interact with logs."""
 
+    # Size and age a log file may reach before it is rotated, and how many old files are kept
+    MAX_BYTES = 1024 * 1024
+    BACKUP_COUNT = 5
+    ROTATE_INTERVAL = 24 * 60 * 60
+    # Seconds between writes of batched log records to disk
+    FLUSH_INTERVAL = 5.0
+
+    # The pipeline is set up by the first Logs() in the process, and shared by every later one
+    _setup_lock = threading.Lock()
+    _listener = None
+
     def __init__(self, app_name: str, *args, **kwargs):
         """
         Start a logger for the app you're calling from.
 
+        Records go through a queue to a single listener thread, so callers never block on disk I/O.
+
         Args:
             app_name: Used to identify app (or section of app) adding to logfile.
         """
         super().__init__(*args, **kwargs)
-
+        self.app_logger = logging.getLogger()
+        self.app = app_name
+        with Logs._setup_lock:
+            if Logs._listener is None:
+                Logs._setup()
+        self.level = logging.getLevelName(self.app_logger.level)
+
+    @classmethod
+    def _setup(cls) -> None:
+        """ Read logging settings and start the queue listener. Called once per process. """
         # Define the path for Settings.ini relative to the current working directory
         log_settings = os.path.join(os.getcwd(), 'Settings.ini')
 
@@ -177,66 +573,51 @@ class Logs:
         if x['success'] and not x['result']:
             # If Settings.ini doesn't exist, create it and set default logging settings
             print(f"Settings.ini not found, creating it: {log_settings}")
-            y = Files.create(log_settings)
-            if y['success']:
-                print(f"File created: {log_settings}")
-                settings = {
-                    'LOGGING_LEVEL': 'INFO',
-                    'LOGGING_DIR': 'Logs/',
-                }
-                # Ensure 'LOGGING' section and default settings are written
-                config = configparser.ConfigParser()
-                config.read(log_settings)
-                if not config.has_section('LOGGING'):
-                    config.add_section('LOGGING')
+            settings = {
+                'LOGGING_LEVEL': 'INFO',
+                'LOGGING_DIR': 'Logs/',
+            }
+            # Write the 'LOGGING' section and default settings in one atomic write
+            with Settings.transaction(log_settings) as tx:
                 for key, value in settings.items():
-                    config.set('LOGGING', key, value)
-                # Write settings back to the config file
-                with open(log_settings, 'w', encoding='utf-8') as configfile:
-                    config.write(configfile)
-            else:
-                print(f"Error creating file: {y['result']}")
-
-        # Load the configuration settings for logging
-        config = configparser.ConfigParser()
-        config.read(log_settings)
-
-        # Ensure the 'LOGGING' section exists before reading settings
-        if not config.has_section('LOGGING'):
-            print(f"Error: 'LOGGING' section missing in {log_settings}")
-            level = 'INFO'  # Default to INFO if section is missing
-        else:
-            load_level = Ini.load(log_settings, 'LOGGING', 'LOGGING_LEVEL')
-            level = load_level['result'] if load_level['success'] else 'INFO'
-
-        # Set up logging
-        self.app_logger = logging.getLogger()
-        self.app = app_name
-        today = datetime.datetime.now().strftime("%b-%d-%Y")
-        log_path = f"Logs/{today}.log"
-
-        # Ensure the 'Logs' directory exists before creating log file
-        log_dir = 'Logs'
-        x = Files.check_exist(log_dir)
-        if x['success'] and not x['result']:
-            os.makedirs(log_dir, exist_ok=True)  # Create the directory if it doesn't exist
-
-        # Ensure log file is created
-        x = Files.check_exist(log_path)
-        if x['success'] and not x['result']:
-            y = Files.create(log_path)
-            if y['success']:
-                print(f"Created {log_path}")
+                    tx.set(key, value, section='LOGGING')
+            if tx.result['success']:
+                print(f"File created: {log_settings}")
             else:
-                print(f"Error creating file: {y['result']}")
-        else:
-            print(f"Log file exists: {log_path}")
-
-        # Set up the logging configuration
-        logging.basicConfig(filename=log_path, format="%(message)s")
-        self.level = level.upper() if level else 'INFO'
-        self.app_logger.setLevel(getattr(logging, self.level))
-        print(f"Logging level set to: {level}")
+                print(f"Error creating file: {tx.result['result']}")
+
+        # Load the logging settings from the cached settings snapshot, with defaults if missing
+        x = Settings.get_many(log_settings, ['LOGGING_LEVEL', 'LOGGING_DIR'], section='LOGGING')
+        if not x['success']:
+            print(f"Error: {x['result']} ({log_settings})")
+        found = x['result'] if x['success'] else {}
+        level = (found.get('LOGGING_LEVEL') or 'INFO').upper()
+        log_dir = found.get('LOGGING_DIR') or 'Logs/'
+
+        # Ensure the log directory exists before creating log file
+        os.makedirs(log_dir, exist_ok=True)
+        log_path = os.path.join(log_dir, 'streambot.log')
+
+        handler = _BatchFileHandler(log_path, cls.MAX_BYTES, cls.BACKUP_COUNT,
+                                    cls.ROTATE_INTERVAL, cls.FLUSH_INTERVAL)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        log_queue = queue.Queue()
+        root = logging.getLogger()
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+        root.setLevel(getattr(logging, level, logging.INFO))
+        cls._listener = _BatchQueueListener(log_queue, handler)
+        cls._listener.start()
+        atexit.register(cls.stop)
+        print(f"Logging level set to: {level}, writing to {log_path}")
+
+    @classmethod
+    def stop(cls) -> None:
+        """ Write out any queued records and stop the listener. Runs at interpreter exit. """
+        with cls._setup_lock:
+            listener, cls._listener = cls._listener, None
+        if listener is not None:
+            listener.stop()
+            listener.handler.close()
 
     def set_level(self, level: str):
         """
@@ -247,20 +628,32 @@ class Logs:
         """
         new_level = level.upper()
         self.app_logger.setLevel(getattr(logging, new_level))
+        self.level = new_level
         print(f"Logging level updated to {new_level}")
 
-    def info(self, message: str) -> None:
+    # Messages are %-style, formatted only if the level is enabled: logs.debug("Set %s = %s", key, value)
+
+    def info(self, message: str, *args) -> None:
         """ Log an INFO entry. """
-        self.app_logger.info("%s - INFO: %s", self.app, message)
+        self._log(logging.INFO, 'INFO', message, args)
 
-    def debug(self, message: str) -> None:
+    def debug(self, message: str, *args) -> None:
         """ Log a DEBUG entry. """
-        self.app_logger.debug("%s - DEBUG: %s", self.app, message)
+        self._log(logging.DEBUG, 'DEBUG', message, args)
 
-    def error(self, message: str) -> None:
+    def error(self, message: str, *args) -> None:
         """ Log an ERROR entry. """
-        self.app_logger.error("%s - ERROR: %s", self.app, message)
+        self._log(logging.ERROR, 'ERROR', message, args)
 
-    def critical(self, message: str) -> None:
+    def critical(self, message: str, *args) -> None:
         """ Log a CRITICAL entry. """
-        self.app_logger.critical("%s - CRITICAL: %s", self.app, message)
+        self._log(logging.CRITICAL, 'CRITICAL', message, args)
+
+    def _log(self, level: int, name: str, message: str, args: tuple) -> None:
+        # Nothing is built for disabled levels, the message is only formatted if a record is made
+        if not self.app_logger.isEnabledFor(level):
+            return
+        if args:
+            self.app_logger.log(level, "%s - %s: " + message, self.app, name, *args)
+        else:
+            self.app_logger.log(level, "%s - %s: %s", self.app, name, message)